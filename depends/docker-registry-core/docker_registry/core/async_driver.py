@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Docker.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+docker_registry.core.async_driver
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+This file defines the asynchronous flavor of the driver interface.
+
+Instead of blocking, the methods of an asynchronous driver return a future,
+that is any object following the `gevent.event.AsyncResult` interface
+(`get()`, `ready()`, `rawlink()`...), so that a single greenlet can have
+several calls in flight. `stream_read` returns an iterator which only ever
+blocks the greenlet consuming it.
+
+Adapters convert in both directions:
+ * `Adapter` turns a synchronous driver into an asynchronous one
+ * `SyncAdapter` turns an asynchronous driver into a synchronous one, which
+   can be used by the registry like any other driver
+"""
+
+__all__ = ["fetch", "done", "Base", "Adapter", "SyncAdapter"]
+
+import sys
+
+from . import driver
+from .exceptions import NotImplementedError
+import gevent
+import gevent.event
+
+
+class Base(object):
+
+    """Asynchronous storage interface
+
+    Same methods as `docker_registry.core.driver.Base`, returning futures.
+    """
+
+    def _not_implemented(self, signature):
+        raise NotImplementedError(
+            "You must implement %s on your asynchronous storage %s" %
+            (signature, self.__class__.__name__))
+
+    def get_content(self, path):
+        """Method to get content, the future holds the content."""
+        self._not_implemented('get_content(self, path)')
+
+    def put_content(self, path, content):
+        """Method to put content."""
+        self._not_implemented('put_content(self, path, content)')
+
+    def stream_read(self, path, bytes_range=None):
+        """Method to stream read, returns an iterator of chunks."""
+        self._not_implemented('stream_read(self, path, bytes_range=None)')
+
+    def stream_write(self, path, fp):
+        """Method to stream write."""
+        self._not_implemented('stream_write(self, path, fp)')
+
+    def list_directory(self, path=None):
+        """Method to list directory, the future holds a list."""
+        self._not_implemented('list_directory(self, path=None)')
+
+    def exists(self, path):
+        """Method to test exists, the future holds a boolean."""
+        self._not_implemented('exists(self, path)')
+
+    def remove(self, path):
+        """Method to remove."""
+        self._not_implemented('remove(self, path)')
+
+    def get_size(self, path):
+        """Method to get the size, the future holds the size."""
+        self._not_implemented('get_size(self, path)')
+
+    def stat(self, path):
+        """Method to get the metadata, the future holds a Stat or None."""
+        self._not_implemented('stat(self, path)')
+
+
+class Adapter(Base):
+
+    """Turn a synchronous driver into an asynchronous one
+
+    Every call runs in its own greenlet, which is enough for drivers whose
+    I/O is made cooperative by gevent (the network based ones). Subclasses
+    can change where calls run by overriding `_submit`. Other attributes,
+    such as the path helpers, are those of the wrapped driver.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+    def _submit(self, fn, *args):
+        return gevent.spawn(fn, *args)
+
+    def get_content(self, path):
+        return self._submit(self._storage.get_content, path)
+
+    def put_content(self, path, content):
+        return self._submit(self._storage.put_content, path, content)
+
+    def stream_read(self, path, bytes_range=None):
+        return self._storage.stream_read(path, bytes_range)
+
+    def stream_write(self, path, fp):
+        return self._submit(self._storage.stream_write, path, fp)
+
+    def list_directory(self, path=None):
+        return self._submit(
+            lambda: list(self._storage.list_directory(path)))
+
+    def exists(self, path):
+        return self._submit(self._storage.exists, path)
+
+    def remove(self, path):
+        return self._submit(self._storage.remove, path)
+
+    def get_size(self, path):
+        return self._submit(self._storage.get_size, path)
+
+    def stat(self, path):
+        return self._submit(self._storage.stat, path)
+
+
+class SyncAdapter(driver.Base):
+
+    """Turn an asynchronous driver into a synchronous one
+
+    Every call blocks the calling greenlet until its future is ready.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        for attr in ('scheme', 'buffer_size', 'supports_bytes_range',
+                     'images_shard_depth'):
+            if hasattr(storage, attr):
+                setattr(self, attr, getattr(storage, attr))
+
+    def content_redirect_url(self, path):
+        redirect = getattr(self._storage, 'content_redirect_url', None)
+        return redirect(path) if redirect else None
+
+    def get_content(self, path):
+        return self._storage.get_content(path).get()
+
+    def put_content(self, path, content):
+        return self._storage.put_content(path, content).get()
+
+    def stream_read(self, path, bytes_range=None):
+        return self._storage.stream_read(path, bytes_range)
+
+    def stream_write(self, path, fp):
+        return self._storage.stream_write(path, fp).get()
+
+    def list_directory(self, path=None):
+        return self._storage.list_directory(path).get()
+
+    def exists(self, path):
+        return self._storage.exists(path).get()
+
+    def remove(self, path):
+        return self._storage.remove(path).get()
+
+    def get_size(self, path):
+        return self._storage.get_size(path).get()
+
+    def stat(self, path):
+        return self._storage.stat(path).get()
+
+
+def done(fn, *args):
+    """Call fn right away and return its outcome as a ready future."""
+    result = gevent.event.AsyncResult()
+    try:
+        result.set(fn(*args))
+    except Exception as e:
+        result.set_exception(e)
+    return result
+
+
+def fetch(name):
+    """Return the asynchronous storage class of a driver
+
+    Drivers can provide a native `AsyncStorage`, others are wrapped in an
+    Adapter.
+    """
+    storage = driver.fetch(name)
+    async_storage = getattr(sys.modules[storage.__module__],
+                            'AsyncStorage', None)
+    if async_storage is None:
+        def async_storage(path=None, config=None):
+            return Adapter(storage(path, config))
+    return async_storage
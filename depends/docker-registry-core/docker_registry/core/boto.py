@@ -26,114 +26,315 @@ Might be useful for
 
 """
 
+from __future__ import absolute_import
+
+import gevent.event
+import gevent.lock
 import gevent.monkey
+import gevent.pool
 gevent.monkey.patch_all()
 
+import collections
 import copy
+import email.utils
 import logging
 import math
 import os
-import tempfile
+import time
 
 from . import driver
 from . import lru
 from .exceptions import FileNotFoundError
+import boto.connection
 
 logger = logging.getLogger(__name__)
 
 
-class ParallelKey(object):
+class _Part(object):
+
+    """A byte range of a ParallelKey, buffered in memory as it arrives."""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.size = end - start + 1
+        self.received = 0
+        self.error = None
+        self._chunks = collections.deque()
+        self._done = False
+        self._event = gevent.event.Event()
+
+    def feed(self, buf):
+        self._chunks.append(buf)
+        self.received += len(buf)
+        self._event.set()
+
+    def finish(self, error=None):
+        self.error = error
+        self._done = True
+        self._event.set()
+
+    def read(self):
+        """Return the next chunk, '' once the part has been consumed."""
+        while not self._chunks:
+            if self.error is not None:
+                raise self.error
+            if self._done:
+                return ''
+            self._event.clear()
+            self._event.wait()
+        return self._chunks.popleft()
 
-    """This class implements parallel transfer on a key to improve speed."""
+    def unread(self, buf):
+        self._chunks.appendleft(buf)
 
-    CONCURRENCY = 5
 
-    def __init__(self, key):
-        logger.info('ParallelKey: {0}; size={1}'.format(key, key.size))
+class ParallelKey(object):
+
+    """This class implements parallel transfer on a key to improve speed.
+
+    The key, or the given (inclusive) byte range of it, is split in parts
+    fetched concurrently with ranged GETs, and read back in order: each
+    chunk is handed to the reader as soon as it arrives, waking it up
+    through an event. Parts are sized after the
+    throughput observed on previous transfers so that each takes about
+    PART_DURATION seconds, up to MAX_BUFFER / MAX_CONCURRENCY bytes, and
+    are kept in memory: at most MAX_BUFFER bytes of parts (and never less
+    than one part) are fetched ahead of the reader. Fast links thus get
+    smaller parts rather than less concurrency.
+    """
+
+    MIN_PART_SIZE = 1024 * 1024
+    MAX_PART_SIZE = 64 * 1024 * 1024
+    MAX_CONCURRENCY = 8
+    MAX_BUFFER = 64 * 1024 * 1024
+    PART_DURATION = 2.0
+    PART_RETRIES = 2
+    buffer_size = 128 * 1024
+
+    # Per connection throughput (bytes/s), shared by all transfers
+    throughput = 8 * 1024 * 1024
+
+    def __init__(self, key, bytes_range=None):
         self._boto_key = key
-        self._cursor = 0
-        self._max_completed_byte = 0
-        self._max_completed_index = 0
-        self._tmpfile = tempfile.NamedTemporaryFile(mode='rb')
-        self._completed = [0] * self.CONCURRENCY
-        self._spawn_jobs()
+        self._part_index = 0
+        self._next_part = 0
+        (start, end) = bytes_range or (0, key.size - 1)
+        part_size = self._part_size(end - start + 1)
+        self._parts = [_Part(i, min(i + part_size - 1, end))
+                       for i in range(start, end + 1, part_size)]
+        # Parts fetched but not consumed yet, held in memory
+        self.window = max(1, self.MAX_BUFFER // part_size)
+        concurrency = min(self.MAX_CONCURRENCY, len(self._parts),
+                          self.window)
+        self._window = gevent.lock.Semaphore(self.window)
+        logger.info('ParallelKey: {0}; range={1}-{2}; parts={3}x{4}; '
+                    'concurrency={5}'.format(key, start, end,
+                                             len(self._parts), part_size,
+                                             concurrency))
+        self._workers = [gevent.spawn(self._worker)
+                         for i in range(concurrency)]
 
     def __del__(self):
-        self._tmpfile.close()
-
-    def _generate_bytes_ranges(self, num_parts):
-        size = self._boto_key.size
-        chunk_size = int(math.ceil(1.0 * size / num_parts))
-        for i in range(num_parts):
-            yield (i, chunk_size * i, min(chunk_size * (i + 1) - 1, size - 1))
-
-    def _fetch_part(self, fname, index, min_cur, max_cur):
-        boto_key = copy.copy(self._boto_key)
-        with open(fname, 'wb') as f:
-            f.seek(min_cur)
-            brange = 'bytes={0}-{1}'.format(min_cur, max_cur)
-            boto_key.get_contents_to_file(f, headers={'Range': brange})
-            boto_key.close()
-        self._completed[index] = (index, max_cur)
-        self._refresh_max_completed_byte()
-
-    def _spawn_jobs(self):
-        bytes_ranges = self._generate_bytes_ranges(self.CONCURRENCY)
-        for i, min_cur, max_cur in bytes_ranges:
-            gevent.spawn(self._fetch_part, self._tmpfile.name,
-                         i, min_cur, max_cur)
-
-    def _refresh_max_completed_byte(self):
-        for v in self._completed[self._max_completed_index:]:
-            if v == 0:
+        self.close()
+
+    @classmethod
+    def _part_size(cls, size):
+        part_size = min(int(cls.throughput * cls.PART_DURATION),
+                        int(math.ceil(1.0 * size / cls.MAX_CONCURRENCY)))
+        # MAX_BUFFER holds one part per connection
+        max_part_size = min(cls.MAX_PART_SIZE,
+                            cls.MAX_BUFFER // cls.MAX_CONCURRENCY)
+        return max(cls.MIN_PART_SIZE, min(max_part_size, part_size))
+
+    @classmethod
+    def _observe(cls, nbytes, elapsed):
+        if nbytes < cls.MIN_PART_SIZE or elapsed <= 0:
+            return
+        cls.throughput = int(0.8 * cls.throughput + 0.2 * nbytes / elapsed)
+
+    def _worker(self):
+        while True:
+            self._window.acquire()
+            if self._next_part >= len(self._parts):
+                self._window.release()
                 return
-            self._max_completed_index = v[0]
-            self._max_completed_byte = v[1]
-            if self._max_completed_index >= len(self._completed) - 1:
-                percent = round(
-                    (100.0 * self._cursor) / self._boto_key.size, 1)
-                logger.info('ParallelKey: {0}; buffering complete at {1}% of '
-                            'the total transfer; now serving straight from '
-                            'the tempfile'.format(self._boto_key, percent))
+            part = self._parts[self._next_part]
+            self._next_part += 1
+            self._fetch_part(part)
+
+    def _fetch_part(self, part):
+        attempts = 0
+        started = time.time()
+        while part.received < part.size:
+            boto_key = copy.copy(self._boto_key)
+            boto_key.resp = None
+            brange = 'bytes={0}-{1}'.format(part.start + part.received,
+                                            part.end)
+            try:
+                boto_key.open_read(headers={'Range': brange})
+                while True:
+                    buf = boto_key.read(self.buffer_size)
+                    if not buf:
+                        break
+                    part.feed(buf)
+                if part.received < part.size:
+                    raise IOError('short read on {0}'.format(brange))
+            except Exception as e:
+                boto_key.close(fast=True)
+                attempts += 1
+                if attempts > self.PART_RETRIES:
+                    logger.error('ParallelKey: {0}; giving up on {1}: '
+                                 '{2}'.format(self._boto_key, brange, e))
+                    part.finish(e)
+                    return
+                logger.warn('ParallelKey: {0}; retrying {1}: {2}'.format(
+                    self._boto_key, brange, e))
+        self._observe(part.size, time.time() - started)
+        part.finish()
 
     def read(self, size):
-        if self._cursor >= self._boto_key.size:
-            # Read completed
-            return ''
-        sz = size
-        if self._max_completed_index < len(self._completed) - 1:
-            # Not all data arrived yet
-            if self._cursor + size > self._max_completed_byte:
-                while self._cursor >= self._max_completed_byte:
-                    # We're waiting for more data to arrive
-                    gevent.sleep(0.2)
-            if self._cursor + sz > self._max_completed_byte:
-                sz = self._max_completed_byte - self._cursor
-        # Use a low-level read to avoid any buffering (makes sure we don't
-        # read more than `sz' bytes).
-        buf = os.read(self._tmpfile.file.fileno(), sz)
-        self._cursor += len(buf)
-        if not buf:
-            message = ('ParallelKey: {0}; got en empty read on the buffer! '
-                       'cursor={1}, size={2}; Transfer interrupted.'.format(
-                           self._boto_key, self._cursor, self._boto_key.size))
-            logging.error(message)
-            raise RuntimeError(message)
-        return buf
+        while self._part_index < len(self._parts):
+            part = self._parts[self._part_index]
+            buf = part.read()
+            if buf:
+                if len(buf) > size:
+                    part.unread(buf[size:])
+                    buf = buf[:size]
+                return buf
+            # Part consumed, let the workers fetch further
+            self._part_index += 1
+            self._window.release()
+        return ''
+
+    def close(self):
+        gevent.killall(getattr(self, '_workers', []), block=False)
+
+
+class HostConnectionPool(boto.connection.HostConnectionPool):
+
+    """Idle connections to a single host, evicted after idle_timeout
+
+    Unlike boto's, evicted connections are closed when nobody is reading
+    from them anymore, instead of lingering until garbage collected.
+    """
+
+    def __init__(self, pool):
+        super(HostConnectionPool, self).__init__()
+        self._pool = pool
+
+    def _pair_stale(self, pair):
+        return pair[1] + self._pool.idle_timeout < time.time()
+
+    def clean(self):
+        while self.queue and self._pair_stale(self.queue[0]):
+            (conn, _) = self.queue.pop(0)
+            self._pool._close(self, conn)
+
+    def evict_oldest(self):
+        """Close the oldest connection that is not in use, if any."""
+        for i, (conn, _) in enumerate(self.queue):
+            if self._conn_ready(conn):
+                del self.queue[i]
+                self._pool._close(self, conn)
+                return True
+        return False
+
+
+class ConnectionPool(boto.connection.ConnectionPool):
+
+    """Bounded pool of keep-alive connections, shared by all greenlets
+
+    boto keeps every connection handed back to its pool, so a burst of
+    concurrent requests leaves as many sockets open. This pool keeps at
+    most max_idle_per_host idle connections per host and max_idle overall,
+    closes the extra ones, and counts hits (reused connections), misses
+    (new connections) and evictions. Connections in use are not capped:
+    they are bounded by the concurrency of the callers.
+    """
+
+    def __init__(self, max_idle=100, max_idle_per_host=50, idle_timeout=60.0):
+        super(ConnectionPool, self).__init__()
+        self.max_idle = max_idle
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _close(self, host_pool, conn):
+        self.evictions += 1
+        if host_pool._conn_ready(conn):
+            conn.close()
+
+    def get_http_connection(self, host, port, is_secure):
+        conn = super(ConnectionPool, self).get_http_connection(
+            host, port, is_secure)
+        if conn is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return conn
+
+    def put_http_connection(self, host, port, is_secure, conn):
+        with self.mutex:
+            key = (host, port, is_secure)
+            if key not in self.host_to_pool:
+                self.host_to_pool[key] = HostConnectionPool(self)
+            host_pool = self.host_to_pool[key]
+            host_pool.put(conn)
+            if host_pool.size() > self.max_idle_per_host:
+                host_pool.evict_oldest()
+            if self.size() > self.max_idle:
+                # Make room on the host with the most connections
+                largest = max(self.host_to_pool.values(),
+                              key=lambda pool: pool.size())
+                largest.evict_oldest()
+
+    def stats(self):
+        with self.mutex:
+            hosts = dict(('{0}:{1}'.format(host, port), pool.size())
+                         for ((host, port, _), pool)
+                         in self.host_to_pool.items())
+        return {'size': sum(hosts.values()),
+                'hosts': hosts,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
 
 
 class Base(driver.Base):
 
     supports_bytes_range = True
+    # Number of concurrent requests issued by the batch methods
+    batch_concurrency = 10
+    # Largest object copied by a single request on the server side
+    max_copy_size = 5 * 1024 * 1024 * 1024
 
     def __init__(self, path=None, config=None):
         self._config = config
         self._root_path = path or '/test'
         self._boto_conn = self.makeConnection()
+        # Every key of the bucket (including the copies made by ParallelKey)
+        # goes through this connection, hence through this pool
+        self._boto_conn._pool = self.makeConnectionPool()
         self._boto_bucket = self._boto_conn.get_bucket(
             self._config.boto_bucket)
         logger.info("Boto based storage initialized")
 
+    def makeConnectionPool(self):
+        kwargs = {}
+        for (arg, cast) in [('max_idle', int), ('max_idle_per_host', int),
+                            ('idle_timeout', float)]:
+            value = getattr(self._config, 'boto_pool_' + arg, None)
+            if value is not None:
+                kwargs[arg] = cast(value)
+        return ConnectionPool(**kwargs)
+
+    def pool_stats(self):
+        """Return the metrics of the connection pool."""
+        return self._boto_conn._pool.stats()
+
     def _build_connection_params(self):
         kwargs = {'is_secure': (self._config.s3_secure is True)}
         config_args = [
@@ -160,6 +361,13 @@ class Base(driver.Base):
             return orig_meth(*args, **kwargs)
         key.bucket.connection.make_request = new_meth
 
+    def _batch(self, fn, items):
+        """Call fn on every item concurrently, returns {item: result}."""
+        pool = gevent.pool.Pool(self.batch_concurrency)
+        greenlets = dict((item, pool.spawn(fn, item)) for item in items)
+        gevent.joinall(greenlets.values(), raise_error=True)
+        return dict((k, g.value) for (k, g) in greenlets.items())
+
     def _init_path(self, path=None):
         path = os.path.join(self._root_path, path) if path else self._root_path
         if path and path[0] == '/':
@@ -168,22 +376,28 @@ class Base(driver.Base):
 
     def stream_read(self, path, bytes_range=None):
         path = self._init_path(path)
-        headers = None
-        if bytes_range:
-            headers = {'Range': 'bytes={0}-{1}'.format(*bytes_range)}
-        key = self._boto_bucket.lookup(path, headers=headers)
+        key = self._boto_bucket.lookup(path)
         if not key:
             raise FileNotFoundError('%s is not there' % path)
-        if not bytes_range and key.size > 1024 * 1024:
-            # Use the parallel key only if the key size is > 1MB
-            # And if bytes_range is not enabled (since ParallelKey is already
-            # using bytes range)
-            key = ParallelKey(key)
-        while True:
-            buf = key.read(self.buffer_size)
-            if not buf:
-                break
-            yield buf
+        (start, end) = (0, key.size - 1)
+        if bytes_range:
+            (start, end) = (bytes_range[0], min(bytes_range[1], end))
+        if end - start + 1 > 1024 * 1024:
+            # Use the parallel key only if the object (or range) is > 1MB
+            key = ParallelKey(key, (start, end))
+        elif bytes_range:
+            key.open_read(headers={
+                'Range': 'bytes={0}-{1}'.format(start, end)})
+        try:
+            while True:
+                buf = key.read(self.buffer_size)
+                if not buf:
+                    break
+                yield buf
+        finally:
+            if isinstance(key, ParallelKey):
+                # Stop fetching if the client went away
+                key.close()
 
     def list_directory(self, path=None):
         path = self._init_path(path)
@@ -213,8 +427,35 @@ class Base(driver.Base):
             raise FileNotFoundError('%s is not there' % path)
         return key.size
 
+    def stat(self, path):
+        path = self._init_path(path)
+        # Lookup does a HEAD HTTP Request on the object
+        key = self._boto_bucket.lookup(path)
+        if not key:
+            return None
+        mtime = None
+        if key.last_modified:
+            mtime = email.utils.mktime_tz(
+                email.utils.parsedate_tz(key.last_modified))
+        etag = key.etag.strip('"') if key.etag else None
+        return driver.Stat(key.size, mtime, etag)
+
+    def move(self, src, dst):
+        key = self._boto_bucket.lookup(self._init_path(src))
+        if not key:
+            raise FileNotFoundError('%s is not there' % src)
+        if key.size > self.max_copy_size:
+            return super(Base, self).move(src, dst)
+        # Copied on the server side, nothing goes through the registry
+        self._boto_bucket.copy_key(self._init_path(dst),
+                                   self._boto_bucket.name, key.name)
+        self.remove(src)
+
     @lru.get
     def get_content(self, path):
+        return self._get_content(path)
+
+    def _get_content(self, path):
         path = self._init_path(path)
         key = self.makeKey(path)
         if not key.exists():
@@ -245,3 +486,28 @@ class Base(driver.Base):
             key.delete()
         if not exists:
             raise FileNotFoundError('%s is not there' % path)
+
+    @lru.get_many
+    def get_many(self, paths):
+        def get(path):
+            try:
+                return self._get_content(path)
+            except FileNotFoundError:
+                return None
+        contents = self._batch(get, paths)
+        return dict((k, v) for (k, v) in contents.items() if v is not None)
+
+    def put_many(self, contents):
+        self._batch(lambda path: self.put_content(path, contents[path]),
+                    contents.keys())
+
+    def exists_many(self, paths):
+        return self._batch(self.exists, paths)
+
+    def remove_many(self, paths):
+        def remove(path):
+            try:
+                self.remove(path)
+            except FileNotFoundError:
+                pass
+        self._batch(remove, paths)
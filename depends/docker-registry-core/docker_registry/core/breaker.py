@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Docker.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+docker_registry.core.breaker
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Redis client failing fast while Redis is down.
+
+Redis only holds caches, locks and queues, which every caller already
+skips on connection errors. The client here uses tight socket timeouts and
+a circuit breaker: after `failures' errors in a row, every command fails
+at once (CircuitOpen) for `cooldown' seconds, then a single command is let
+through to probe Redis. Timeouts are raised as connection errors too, so
+that an outage degrades to "no cache" instead of "slow registry".
+"""
+
+__all__ = ["CircuitOpen", "Breaker", "Client", "connect", "stats"]
+
+import logging
+import time
+
+import redis
+logger = logging.getLogger(__name__)
+
+# Seconds, for the socket operations and the connection
+SOCKET_TIMEOUT = 0.5
+CONNECT_TIMEOUT = 0.25
+
+_breakers = {}
+
+
+class CircuitOpen(redis.exceptions.ConnectionError):
+    pass
+
+
+class Breaker(object):
+    """Circuit breaker
+
+    closed: calls go through, `failures' errors in a row open it.
+    open: calls are refused for `cooldown' seconds.
+    half-open: one call goes through, its outcome closes or re-opens it.
+    """
+
+    failures = 5
+    cooldown = 30
+
+    def __init__(self, name, failures=None, cooldown=None):
+        self.name = name
+        if failures is not None:
+            self.failures = int(failures)
+        if cooldown is not None:
+            self.cooldown = float(cooldown)
+        self.state = 'closed'
+        self.opened_at = None
+        self.consecutive = 0
+        self.calls = 0
+        self.errors = 0
+        self.refused = 0
+        self.trips = 0
+        self.last_error = None
+        self._probing = False
+
+    def allow(self, now=None):
+        """Whether a call may go through now."""
+        if self.state == 'closed':
+            return True
+        now = now or time.time()
+        if self.state == 'open' and now - self.opened_at >= self.cooldown:
+            self.state = 'half-open'
+        if self.state == 'half-open' and not self._probing:
+            self._probing = True
+            return True
+        self.refused += 1
+        return False
+
+    def success(self):
+        self.calls += 1
+        self.consecutive = 0
+        self._probing = False
+        if self.state != 'closed':
+            logger.info('Redis {0}: circuit closed'.format(self.name))
+            self.state = 'closed'
+
+    def failure(self, error, now=None):
+        self.calls += 1
+        self.errors += 1
+        self.consecutive += 1
+        self.last_error = str(error)
+        self._probing = False
+        if self.state == 'half-open' or (
+                self.state == 'closed' and self.consecutive >= self.failures):
+            if self.state == 'closed':
+                self.trips += 1
+            logger.warning('Redis {0}: circuit open for {1}s ({2})'.format(
+                self.name, self.cooldown, error))
+            self.state = 'open'
+            self.opened_at = now or time.time()
+
+    def stats(self):
+        return {'state': self.state,
+                'calls': self.calls,
+                'errors': self.errors,
+                'refused': self.refused,
+                'trips': self.trips,
+                'consecutive_errors': self.consecutive,
+                'last_error': self.last_error}
+
+    def call(self, fn, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpen('Redis {0}: circuit open'.format(self.name))
+        try:
+            result = fn(*args, **kwargs)
+        except redis.exceptions.TimeoutError as e:
+            self.failure(e)
+            raise redis.exceptions.ConnectionError(
+                'Redis {0}: timeout: {1}'.format(self.name, e))
+        except redis.exceptions.ConnectionError as e:
+            self.failure(e)
+            raise
+        except redis.exceptions.RedisError:
+            # Redis answered
+            self.success()
+            raise
+        self.success()
+        return result
+
+
+class Pipeline(redis.client.StrictPipeline):
+
+    breaker = None
+
+    def execute(self, raise_on_error=True):
+        execute = super(Pipeline, self).execute
+        return self.breaker.call(execute, raise_on_error)
+
+
+class Client(redis.StrictRedis):
+    """StrictRedis whose commands and pipelines go through a Breaker."""
+
+    def __init__(self, breaker, **kwargs):
+        kwargs.setdefault('socket_timeout', SOCKET_TIMEOUT)
+        kwargs.setdefault('socket_connect_timeout', CONNECT_TIMEOUT)
+        super(Client, self).__init__(**kwargs)
+        self.breaker = breaker
+
+    def execute_command(self, *args, **options):
+        execute = super(Client, self).execute_command
+        return self.breaker.call(execute, *args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = Pipeline(self.connection_pool, self.response_callbacks,
+                        transaction, shard_hint)
+        pipe.breaker = self.breaker
+        return pipe
+
+
+def connect(name, failures=None, cooldown=None, socket_timeout=None,
+            connect_timeout=None, **kwargs):
+    """Return a Client, its breaker reported by stats() under name."""
+    breaker = _breakers[name] = Breaker(name, failures, cooldown)
+    if socket_timeout is not None:
+        kwargs['socket_timeout'] = float(socket_timeout)
+    if connect_timeout is not None:
+        kwargs['socket_connect_timeout'] = float(connect_timeout)
+    return Client(breaker, **kwargs)
+
+
+def stats():
+    """Return the health of every breaker, by name."""
+    return dict((name, breaker.stats())
+                for (name, breaker) in _breakers.items())
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Docker.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+docker_registry.core.cluster
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Several Redis instances used as one cache, sharded client side.
+
+Keys are spread over the nodes by consistent hashing (see hashring), so
+adding or removing a node only moves about 1/N of the keys. Hot keys (the
+ones `hot' returns True for) are stored on `replicas' nodes: reads are
+spread over these, and go on being served when one of them is down.
+
+Every node has its own circuit breaker (see breaker). A node which drops
+out is skipped at once: its keys are cache misses until it comes back,
+instead of being moved to another node, where they would go stale once it
+comes back. A node which missed writes or deletes meanwhile, or whose
+circuit opened, is flushed before this client uses it again: every worker
+(and every registry) reading it then gets misses rather than the values it
+missed the update of. The db of each node must only hold this cache.
+
+Only the commands used by the LRU are provided.
+"""
+
+__all__ = ["Cluster", "parse_node", "parse_nodes"]
+
+import logging
+import random
+import re
+
+from . import breaker
+from . import compat
+from . import hashring
+import redis
+logger = logging.getLogger(__name__)
+
+
+def parse_nodes(nodes):
+    """Return the list of nodes given as a list, or as a string
+
+    Strings list the nodes separated by commas or whitespace (eg: from an
+    environment variable).
+    """
+    if isinstance(nodes, compat.basestring):
+        return [node for node in re.split(r'[\s,]+', nodes) if node]
+    if not isinstance(nodes, (list, tuple)):
+        raise TypeError('Redis nodes must be a list or a string, not '
+                        '{0!r}'.format(nodes))
+    return list(nodes)
+
+
+def parse_node(spec):
+    """Return the connection arguments of a node
+
+    Nodes are given as `host[:port][/db]' strings, or as dicts with host,
+    port, db and password keys.
+    """
+    if isinstance(spec, dict):
+        node = dict((k, spec[k]) for k in ('host', 'port', 'db', 'password')
+                    if spec.get(k) is not None)
+    else:
+        (address, _, db) = str(spec).partition('/')
+        (host, _, port) = address.partition(':')
+        node = {'host': host}
+        if port:
+            node['port'] = port
+        if db:
+            node['db'] = db
+    node['port'] = int(node.get('port', 6379))
+    node['db'] = int(node.get('db', 0))
+    return node
+
+
+def _name(node):
+    return '{0}:{1}/{2}'.format(node['host'], node['port'], node['db'])
+
+
+class Pipeline(object):
+    """Commands buffered per node, sent as one pipeline per node
+
+    execute() returns None: results aren't collected across nodes. A node
+    failing doesn't stop the others, its error is raised last.
+    """
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self._pipes = {}
+
+    def _pipe(self, name):
+        if name not in self._pipes:
+            self._pipes[name] = self.cluster.clients[name].pipeline(
+                transaction=False)
+        return self._pipes[name]
+
+    def set(self, key, value):
+        for name in self.cluster.nodes_for(key):
+            self._pipe(name).set(key, value)
+        return self
+
+    def setex(self, key, ttl, value):
+        for name in self.cluster.nodes_for(key):
+            self._pipe(name).setex(key, ttl, value)
+        return self
+
+    def delete(self, *keys):
+        for key in keys:
+            for name in self.cluster.nodes_for(key):
+                self._pipe(name).delete(key)
+        return self
+
+    def execute(self):
+        error = None
+        for (name, pipe) in self._pipes.items():
+            try:
+                self.cluster.sync(name)
+                pipe.execute()
+            except redis.exceptions.ConnectionError as e:
+                self.cluster.missed(name)
+                error = e
+        self._pipes = {}
+        if error is not None:
+            raise error
+
+
+class Cluster(object):
+
+    def __init__(self, nodes, replicas=2, hot=None, name='lru', **kwargs):
+        """Connect to nodes (see parse_nodes and parse_node)
+
+        kwargs (timeouts, cooldown...) are passed to breaker.connect.
+        """
+        self.nodes = [parse_node(node) for node in parse_nodes(nodes)]
+        self.replicas = max(int(replicas), 1)
+        self.hot = hot
+        self.clients = {}
+        for node in self.nodes:
+            self.clients[_name(node)] = breaker.connect(
+                '{0}:{1}'.format(name, _name(node)),
+                **dict(kwargs, **node))
+        self.ring = hashring.HashRing(sorted(self.clients))
+        # Nodes to flush before they are used again
+        self._stale = set()
+
+    def missed(self, name):
+        """Remember that node `name' missed a write or delete."""
+        self._stale.add(name)
+
+    def sync(self, name):
+        """Flush node `name' if it may hold stale values
+
+        Raises ConnectionError while the node is unreachable.
+        """
+        client = self.clients[name]
+        if client.breaker.state != 'closed':
+            # Other workers may have missed writes meanwhile
+            self._stale.add(name)
+        if name in self._stale:
+            client.flushdb()
+            self._stale.discard(name)
+            logger.info('Redis {0}: flushed, it missed updates'.format(name))
+
+    def nodes_for(self, key):
+        """Return the names of the nodes holding key, its owner first."""
+        if self.hot is not None and self.hot(key):
+            return self.ring.get_nodes(key, self.replicas)
+        return [self.ring.get(key)]
+
+    def _read(self, key, command, *args):
+        """Run a read command on a replica of key, the next on errors."""
+        names = self.nodes_for(key)
+        if len(names) > 1:
+            names = random.sample(names, len(names))
+        for name in names:
+            try:
+                self.sync(name)
+                return getattr(self.clients[name], command)(key, *args)
+            except redis.exceptions.ConnectionError as e:
+                error = e
+        raise error
+
+    def _write(self, key, command, *args):
+        """Run a write command on every replica of key
+
+        Fails only when no replica could be written.
+        """
+        written = False
+        for name in self.nodes_for(key):
+            try:
+                self.sync(name)
+                result = getattr(self.clients[name], command)(key, *args)
+                written = True
+            except redis.exceptions.ConnectionError as e:
+                self.missed(name)
+                error = e
+        if not written:
+            raise error
+        return result
+
+    def get(self, key):
+        return self._read(key, 'get')
+
+    def getrange(self, key, start, end):
+        return self._read(key, 'getrange', start, end)
+
+    def exists(self, key):
+        return self._read(key, 'exists')
+
+    def set(self, key, value):
+        return self._write(key, 'set', value)
+
+    def setex(self, key, ttl, value):
+        return self._write(key, 'setex', ttl, value)
+
+    def delete(self, *keys):
+        pipe = self.pipeline()
+        pipe.delete(*keys)
+        pipe.execute()
+
+    def mget(self, keys):
+        """Return the values of keys, None for those on a node down."""
+        groups = {}
+        for key in keys:
+            names = self.nodes_for(key)
+            groups.setdefault(random.choice(names), []).append(key)
+        values = {}
+        for (name, group) in groups.items():
+            try:
+                self.sync(name)
+                values.update(zip(group, self.clients[name].mget(group)))
+            except redis.exceptions.ConnectionError:
+                pass
+        return [values.get(key) for key in keys]
+
+    def pipeline(self, transaction=False):
+        # Commands spread over several nodes can't be a transaction
+        return Pipeline(self)
+
+    @property
+    def bus(self):
+        """The node carrying the publications, the first one."""
+        return self.clients[_name(self.nodes[0])]
+
+    def publish(self, channel, message):
+        return self.bus.publish(channel, message)
+
+    def info(self):
+        """Return the INFO of every node reachable, by node."""
+        infos = {}
+        for (name, client) in self.clients.items():
+            try:
+                infos[name] = client.info()
+            except redis.exceptions.ConnectionError:
+                infos[name] = None
+        return infos
@@ -32,7 +32,7 @@ import logging
 import sys
 
 __all__ = ['builtin_str', 'str', 'bytes', 'basestring', 'json', 'quote_plus',
-           'StringIO']
+           'StringIO', 'OrderedDict']
 
 logger = logging.getLogger(__name__)
 
@@ -76,6 +76,11 @@ if is_py26:
 else:
     import json  # noqa
 
+if is_py26:
+    from ordereddict import OrderedDict  # noqa
+else:
+    from collections import OrderedDict  # noqa
+
 # ---------
 # Specifics
 # ---------
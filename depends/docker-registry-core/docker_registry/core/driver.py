@@ -26,8 +26,9 @@ Pretty much, the purpose of this is just to abstract the underlying storage
 implementation, for a given scheme.
 """
 
-__all__ = ["fetch", "available", "Base"]
+__all__ = ["fetch", "available", "Base", "ChunkReader", "Stat"]
 
+import collections
 import functools
 import logging
 import pkgutil
@@ -36,10 +37,38 @@ import urllib
 import docker_registry.drivers
 
 from .compat import json
+from .exceptions import FileNotFoundError
 from .exceptions import NotImplementedError
 
 logger = logging.getLogger(__name__)
 
+# Metadata of a stored file, as returned by Base.stat(). mtime is a unix
+# timestamp, both mtime and etag are None when the driver doesn't know them.
+Stat = collections.namedtuple('Stat', ['size', 'mtime', 'etag'])
+
+
+class ChunkReader(object):
+    """File-like object reading an iterator of chunks, for stream_write."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b''
+
+    def read(self, size=-1):
+        bufs = [self._buf]
+        length = len(self._buf)
+        while size < 0 or length < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            bufs.append(chunk)
+            length += len(chunk)
+        data = b''.join(bufs)
+        if size < 0:
+            size = len(data)
+        self._buf = data[size:]
+        return data[:size]
+
 
 def check(value):
     value = str(value)
@@ -82,15 +111,31 @@ class Base(object):
     # the code which uses Storage
     repositories = 'repositories'
     images = 'images'
+    catalog = 'catalog'
+
+    # Number of two characters directory levels images are spread into,
+    # e.g. images/ab/cd/abcdef... with a depth of 2. 0 keeps them flat.
+    images_shard_depth = 0
 
     def _repository_path(self, namespace, repository):
         return '{0}/{1}/{2}'.format(
             self.repositories, namespace, repository)
 
+    def _image_path(self, image_id, shard_depth=None):
+        if shard_depth is None:
+            shard_depth = self.images_shard_depth
+        # Pad short ids so that every shard directory has the same length
+        padded = image_id.ljust(2 * shard_depth, '_')
+        shards = [padded[2 * i:2 * i + 2] for i in range(shard_depth)]
+        return '/'.join([self.images] + shards + [image_id])
+
     # Set the IO buffer to 128kB
     buffer_size = 128 * 1024
     # By default no storage plugin supports it
     supports_bytes_range = False
+    # Whether the methods decorated by lru go through the Redis cache, turned
+    # off for the instances whose contents must not be shared (see tiered)
+    use_lru = True
 
     def __init__(self, path=None, config=None):
         pass
@@ -102,33 +147,37 @@ class Base(object):
             namespace=namespace, repository=repository)
         return '{0}/_images_list'.format(repository_path)
 
+    @filter_args
+    def image_path(self, image_id):
+        return self._image_path(image_id)
+
     @filter_args
     def image_json_path(self, image_id):
-        return '{0}/{1}/json'.format(self.images, image_id)
+        return '{0}/json'.format(self._image_path(image_id))
 
     @filter_args
     def image_mark_path(self, image_id):
-        return '{0}/{1}/_inprogress'.format(self.images, image_id)
+        return '{0}/_inprogress'.format(self._image_path(image_id))
 
     @filter_args
     def image_checksum_path(self, image_id):
-        return '{0}/{1}/_checksum'.format(self.images, image_id)
+        return '{0}/_checksum'.format(self._image_path(image_id))
 
     @filter_args
     def image_layer_path(self, image_id):
-        return '{0}/{1}/layer'.format(self.images, image_id)
+        return '{0}/layer'.format(self._image_path(image_id))
 
     @filter_args
     def image_ancestry_path(self, image_id):
-        return '{0}/{1}/ancestry'.format(self.images, image_id)
+        return '{0}/ancestry'.format(self._image_path(image_id))
 
     @filter_args
     def image_files_path(self, image_id):
-        return '{0}/{1}/_files'.format(self.images, image_id)
+        return '{0}/_files'.format(self._image_path(image_id))
 
     @filter_args
     def image_diff_path(self, image_id):
-        return '{0}/{1}/_diff'.format(self.images, image_id)
+        return '{0}/_diff'.format(self._image_path(image_id))
 
     @filter_args
     def repository_path(self, namespace, repository):
@@ -143,6 +192,24 @@ class Base(object):
             return repository_path
         return '{0}/tag_{1}'.format(repository_path, tagname)
 
+    @filter_args
+    def tag_manifest_path(self, namespace, repository):
+        repository_path = self._repository_path(
+            namespace=namespace, repository=repository)
+        return '{0}/_tags'.format(repository_path)
+
+    @filter_args
+    def catalog_path(self, namespace=None, repository=None):
+        path = '{0}/repositories'.format(self.catalog)
+        if namespace:
+            path = '{0}/{1}'.format(path, namespace)
+        if repository:
+            path = '{0}/{1}'.format(path, repository)
+        return path
+
+    def catalog_complete_path(self):
+        return '{0}/_complete'.format(self.catalog)
+
     @filter_args
     def repository_json_path(self, namespace, repository):
         repository_path = self._repository_path(
@@ -225,6 +292,16 @@ class Base(object):
             "on your storage %s" %
             self.__class__.__name__)
 
+    def move(self, src, dst):
+        """Method to move a file, replacing dst.
+
+        Meant for the files which aren't cached (layers). This default
+        copies the content through the registry, then removes src. Drivers
+        able to rename, or to copy on the server side, should override it.
+        """
+        self.stream_write(dst, ChunkReader(self.stream_read(src)))
+        self.remove(src)
+
     def list_directory(self, path=None):
         """Method to list directory."""
         raise NotImplementedError(
@@ -250,6 +327,52 @@ class Base(object):
             "You must implement get_size(self, path) on your storage %s" %
             self.__class__.__name__)
 
+    def stat(self, path):
+        """Method to get the metadata of a file in a single call.
+
+        Returns a Stat, or None if the file doesn't exist. This default costs
+        two calls, drivers should override it.
+        """
+        if not self.exists(path):
+            return None
+        try:
+            return Stat(self.get_size(path), None, None)
+        except FileNotFoundError:
+            return None
+
+    # Batch methods. The defaults below are sequential, drivers for which a
+    # round trip is expensive should override them.
+
+    def get_many(self, paths):
+        """Method to get the content of several paths.
+
+        Returns a {path: content} dict, missing paths are left out.
+        """
+        contents = {}
+        for path in paths:
+            try:
+                contents[path] = self.get_content(path)
+            except FileNotFoundError:
+                pass
+        return contents
+
+    def put_many(self, contents):
+        """Method to put content on several paths, given a {path: content}."""
+        for path, content in contents.items():
+            self.put_content(path, content)
+
+    def exists_many(self, paths):
+        """Method to test several paths, returns a {path: exists} dict."""
+        return dict((path, self.exists(path)) for path in paths)
+
+    def remove_many(self, paths):
+        """Method to remove several files, missing ones are ignored."""
+        for path in paths:
+            try:
+                self.remove(path)
+            except FileNotFoundError:
+                pass
+
 
 def fetch(name):
     try:
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Docker.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+docker_registry.core.hashring
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Consistent hashing of keys over a set of nodes.
+
+Every node is placed at many points of a ring, a key belongs to the node
+owning the first point following the hash of the key. Adding or removing a
+node only moves the keys of that node, about 1/N of them.
+"""
+
+__all__ = ["HashRing"]
+
+import bisect
+import hashlib
+
+
+def _hash(key):
+    if not isinstance(key, bytes):
+        key = key.encode('utf8')
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+
+    # Points per node, the more the more even the spread
+    replicas = 128
+
+    def __init__(self, nodes=(), replicas=None):
+        if replicas is not None:
+            self.replicas = replicas
+        self._points = []
+        self._owners = {}
+        self.nodes = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.replicas):
+            point = _hash('{0}-{1}'.format(node, i))
+            bisect.insort(self._points, point)
+            self._owners[point] = node
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        for i in range(self.replicas):
+            point = _hash('{0}-{1}'.format(node, i))
+            if self._owners.get(point) == node:
+                del self._owners[point]
+                self._points.remove(point)
+
+    def get(self, key):
+        """Return the node owning key, None if the ring is empty."""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key))
+        if index == len(self._points):
+            index = 0
+        return self._owners[self._points[index]]
+
+    def get_nodes(self, key, count):
+        """Return the count distinct nodes following key, its owner first."""
+        nodes = []
+        if not self._points:
+            return nodes
+        count = min(count, len(self.nodes))
+        index = bisect.bisect(self._points, _hash(key))
+        while len(nodes) < count:
+            if index == len(self._points):
+                index = 0
+            node = self._owners[self._points[index]]
+            if node not in nodes:
+                nodes.append(node)
+            index += 1
+        return nodes
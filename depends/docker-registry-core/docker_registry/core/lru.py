@@ -22,23 +22,348 @@ Redis based LRU.
 Can be activated or de-activated globally.
 Drivers are largely encouraged to use it.
 By default, doesn't run, until one calls init().
+Driver instances setting `use_lru' to False bypass it.
+
+Values are compressed when large enough, and not cached at all when too
+large. An optional in-process cache (L1) sits in front of Redis for the
+contents which never change once written (image metadata), saving a Redis
+round trip on their reads. With the invalidation bus enabled, workers
+publish the paths they write on a Redis channel and evict them from the
+L1 of every other worker, so repository metadata (tags, indexes) is
+cached in-process as well.
+
+Repository metadata (tags, indexes) is only cached in Redis when a ttl is
+set, which bounds how long it can be stale. Keys whose write or delete
+did not reach Redis (unreachable, or its circuit open) are remembered, and
+deleted from it before it is read again.
+
+Every layer (l1, redis, and storage on misses) counts its hits, misses,
+evictions, bytes and latency per class of path (see `metrics'), which
+can also be forwarded to a sink (eg: statsd) with set_sink().
 """
 
 import functools
+import hashlib
+import json
 import logging
+import os
+import re
+import time
+import zlib
 
+from . import breaker
+from . import cluster
+from . import compat
+import gevent
 import redis
 logger = logging.getLogger(__name__)
 
+# Values bigger than this are not cached, values bigger than that compressed
+MAX_VALUE_SIZE = 1024 * 1024
+COMPRESS_MIN_SIZE = 1024
+
+# Values are stored behind a header holding their encoding and hash, so
+# that lru.set compares contents by reading the header only
+HEADER_MAGIC = b'\x00lru'
+ENCODING_RAW = b'r'
+ENCODING_ZLIB = b'z'
+HEADER_SIZE = len(HEADER_MAGIC) + 1 + 40
+
+# Keys which missed their write or delete that are remembered, see _missed
+MAX_MISSED = 100000
+
 redis_conn = None
 cache_prefix = None
+l1 = None
+bus = None
+# Keys which missed their write or delete in Redis (a dict, `set' is taken
+# by the decorator); None when there were too many, Redis is then no longer
+# read
+missed = {}
+options = {'ttl': None,
+           'max_value_size': MAX_VALUE_SIZE,
+           'compress_min_size': COMPRESS_MIN_SIZE}
+
+# Paths whose content never changes once written, admitted in the L1 cache
+# (paths are relative to the storage root, images may be sharded)
+L1_PATHS = re.compile(r'^images/([^/]{2}/)*[^/]+/(json|ancestry|_files)$')
+# Repository metadata, admitted only while invalidations are received
+L1_MUTABLE_PATHS = re.compile(
+    r'^(.*/)?repositories/[^/]+/[^/]+/(_tags|_index_images|json|tag[^/]*)$')
+
+
+# Classes of paths the metrics are broken down by, first match wins
+PATH_CLASSES = [
+    ('image_json', re.compile(r'(^|/)images/.+/json$')),
+    ('ancestry', re.compile(r'(^|/)images/.+/ancestry$')),
+    ('files', re.compile(r'(^|/)images/.+/_files$')),
+    ('diff', re.compile(r'(^|/)images/.+/_diff$')),
+    ('tags', re.compile(r'(^|/)repositories/[^/]+/[^/]+/(_tags|tag[^/]*)$')),
+    ('index_images',
+     re.compile(r'(^|/)repositories/[^/]+/[^/]+/_index_images$')),
+    ('repository_json', re.compile(r'(^|/)repositories/[^/]+/[^/]+/json$')),
+]
+
+
+def path_class(path):
+    for (name, regexp) in PATH_CLASSES:
+        if regexp.search(path):
+            return name
+    return 'other'
+
+
+class Metrics(object):
+    """Counters of the cache layers, per class of path
+
+    Events are counted under (layer, class of the path). When a sink is
+    set, they are also forwarded to it, named `lru.<layer>.<class>.<event>':
+    counters with sink.incr(name, count), latencies (seconds) with
+    sink.timing(name, seconds).
+    """
+
+    events = ('hits', 'misses', 'evictions', 'errors', 'bytes_read',
+              'bytes_written')
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.reset()
+
+    def reset(self):
+        self._counters = {}
+
+    def _entry(self, layer, cls):
+        entry = self._counters.get((layer, cls))
+        if entry is None:
+            entry = dict((event, 0) for event in self.events)
+            entry.update(latency_count=0, latency_total=0.0, latency_max=0.0)
+            self._counters[(layer, cls)] = entry
+        return entry
+
+    def incr(self, layer, path, event, count=1):
+        cls = path_class(path)
+        self._entry(layer, cls)[event] += count
+        if self.sink is not None:
+            self._send('incr', layer, cls, event, count)
+
+    def timing(self, layer, path, seconds):
+        cls = path_class(path)
+        entry = self._entry(layer, cls)
+        entry['latency_count'] += 1
+        entry['latency_total'] += seconds
+        entry['latency_max'] = max(entry['latency_max'], seconds)
+        if self.sink is not None:
+            self._send('timing', layer, cls, 'latency', seconds)
+
+    def _send(self, method, layer, cls, event, value):
+        try:
+            getattr(self.sink, method)(
+                'lru.{0}.{1}.{2}'.format(layer, cls, event), value)
+        except Exception as e:
+            # Metrics never break a request
+            logging.warning("LRU: metrics sink error: {0}".format(e))
+
+    def snapshot(self):
+        """Return the counters as {layer: {class: counters}}."""
+        layers = {}
+        for ((layer, cls), entry) in self._counters.items():
+            counters = dict((event, entry[event]) for event in self.events)
+            lookups = entry['hits'] + entry['misses']
+            counters['hit_ratio'] = (
+                float(entry['hits']) / lookups if lookups else None)
+            count = entry['latency_count']
+            counters['latency'] = {
+                'count': count,
+                'mean': entry['latency_total'] / count if count else None,
+                'max': entry['latency_max']}
+            layers.setdefault(layer, {})[cls] = counters
+        return layers
+
+
+metrics = Metrics()
+
+
+class L1Cache(object):
+    """Per-worker cache, bounded in bytes
+
+    Only the paths matching `paths' are admitted, and those matching
+    `mutable_paths' while `shared' (invalidations from the other workers
+    are received). Least recently used entries are evicted once the
+    contents weigh more than max_size bytes.
+    """
+
+    def __init__(self, max_size, paths=L1_PATHS,
+                 mutable_paths=L1_MUTABLE_PATHS):
+        self.max_size = max_size
+        self.paths = paths
+        self.mutable_paths = mutable_paths
+        self.shared = False
+        # Bumped by every invalidation, see set()
+        self.generation = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Called with the key of every entry evicted
+        self.on_evict = None
+        self._entries = compat.OrderedDict()
+
+    def admits(self, path):
+        if self.paths.match(path):
+            return True
+        return self.shared and bool(self.mutable_paths.match(path))
+
+    def get(self, key):
+        content = self._entries.pop(key, None)
+        if content is None:
+            self.misses += 1
+            return None
+        self._entries[key] = content
+        self.hits += 1
+        return content
+
+    def set(self, key, content, generation=None):
+        """Cache content
+
+        Content read before an invalidation (of its key or not) came in,
+        ie: when generation is not the current one, isn't cached: it may
+        be older than the invalidation.
+        """
+        self.discard(key)
+        if len(content) > self.max_size:
+            return
+        if generation is not None and generation != self.generation:
+            return
+        self._entries[key] = content
+        self.size += len(content)
+        while self.size > self.max_size:
+            (evicted_key, evicted) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted_key)
+
+    def discard(self, key):
+        content = self._entries.pop(key, None)
+        if content is not None:
+            self.size -= len(content)
+
+    def discard_prefix(self, key):
+        prefix = key.rstrip('/') + '/'
+        for k in [k for k in self._entries if k.startswith(prefix)]:
+            self.discard(k)
+
+    def invalidate(self, keys, prefix=False):
+        self.generation += 1
+        for key in keys:
+            self.discard(key)
+            if prefix:
+                # Removing a directory removes its files
+                self.discard_prefix(key)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'max_size': self.max_size,
+                'size': self.size,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'shared': self.shared,
+                'hit_ratio': float(self.hits) / lookups if lookups else None}
+
+
+class Bus(object):
+    """Invalidation bus of the L1 caches, over Redis pub/sub
+
+    Every worker publishes the keys it writes or removes on `channel' and
+    listens to it in a greenlet, started on first use (after the workers
+    are forked). Invalidations published while a worker wasn't listening
+    are lost, so its L1 stops admitting mutable paths until it listens
+    again, and is emptied then.
+    """
+
+    # Seconds between two attempts to subscribe
+    retry_delay = 1
+
+    def __init__(self, conn, channel, cache, listener=None):
+        self.conn = conn
+        # Subscriptions block, they need a connection without timeout
+        self.listener = listener or conn
+        self.channel = channel
+        self.cache = cache
+        self._greenlet = None
+        self._pid = None
+
+    def publish(self, keys, prefix=False):
+        try:
+            self.conn.publish(self.channel, json.dumps(
+                {'keys': list(keys), 'prefix': prefix}))
+        except redis.exceptions.ConnectionError as e:
+            _warn(e)
+
+    def handle(self, data):
+        try:
+            message = json.loads(data)
+            keys = message['keys']
+        except (ValueError, TypeError, KeyError):
+            logging.warning("LRU: invalid invalidation {0!r}".format(data))
+            return
+        self.cache.invalidate(keys, prefix=message.get('prefix', False))
+
+    def start(self):
+        if (self._greenlet is not None and not self._greenlet.dead
+                and self._pid == os.getpid()):
+            return
+        self.cache.shared = False
+        self._pid = os.getpid()
+        self._greenlet = gevent.spawn(self._listen)
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+        self.cache.shared = False
+
+    def _listen(self):
+        while True:
+            pubsub = self.listener.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # Invalidations may have been missed until now
+                self.cache.clear()
+                self.cache.shared = True
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.handle(message['data'])
+            except (redis.exceptions.ConnectionError,
+                    redis.exceptions.TimeoutError) as e:
+                logging.warning(
+                    "LRU: invalidation bus disconnected: {0}".format(e))
+            finally:
+                self.cache.shared = False
+                pubsub.close()
+            gevent.sleep(self.retry_delay)
 
 
 def init(enable=True,
-         host='localhost', port=6379, db=0, password=None, path='/'):
-    global redis_conn, cache_prefix
+         host='localhost', port=6379, db=0, password=None, path='/',
+         l1_size=0, ttl=None, max_value_size=MAX_VALUE_SIZE,
+         compress_min_size=COMPRESS_MIN_SIZE, invalidation=False,
+         socket_timeout=None, connect_timeout=None, cooldown=None,
+         nodes=None, replicas=2):
+    global redis_conn, cache_prefix, l1, bus, options, missed
+    if bus is not None:
+        bus.stop()
+        bus = None
+    missed = {}
     if not enable:
         redis_conn = None
+        l1 = None
         return
     logging.info('Enabling storage cache on Redis')
     logging.info('Redis config: {0}'.format({
@@ -46,36 +371,265 @@ def init(enable=True,
         'port': port,
         'db': db,
         'password': password,
-        'path': path
+        'path': path,
+        'nodes': nodes
     }))
-    redis_conn = redis.StrictRedis(host=host,
-                                   port=int(port),
-                                   db=int(db),
-                                   password=password)
+    if nodes:
+        # Immutable contents are the ones safely replicated
+        redis_conn = cluster.Cluster(nodes, replicas=replicas, hot=_immutable,
+                                     cooldown=cooldown,
+                                     socket_timeout=socket_timeout,
+                                     connect_timeout=connect_timeout,
+                                     password=password)
+        # Invalidations go through the first node
+        (host, port, db) = [redis_conn.nodes[0][k]
+                            for k in ('host', 'port', 'db')]
+        password = redis_conn.nodes[0].get('password', password)
+    else:
+        redis_conn = breaker.connect('lru',
+                                     cooldown=cooldown,
+                                     socket_timeout=socket_timeout,
+                                     connect_timeout=connect_timeout,
+                                     host=host,
+                                     port=int(port),
+                                     db=int(db),
+                                     password=password)
     cache_prefix = 'cache_path:{0}'.format(path)
+    l1 = L1Cache(int(l1_size)) if l1_size else None
+    if l1 is not None:
+        l1.on_evict = _l1_evicted
+    if l1 is not None and invalidation:
+        listener = redis.StrictRedis(host=host, port=int(port), db=int(db),
+                                     password=password)
+        bus = Bus(redis_conn, 'lru_invalidate:{0}'.format(path), l1,
+                  listener)
+    options = {'ttl': int(ttl) if ttl else None,
+               'max_value_size': int(max_value_size),
+               'compress_min_size': int(compress_min_size)}
 
 
 def cache_key(key):
     return cache_prefix + key
 
 
+def _path(key):
+    """Return the path of a cache key."""
+    if cache_prefix and key.startswith(cache_prefix):
+        return key[len(cache_prefix):]
+    return key
+
+
+def _immutable(key):
+    """Whether the content of a cache key never changes once written."""
+    return bool(L1_PATHS.match(_path(key)))
+
+
+def _cached(key):
+    """Whether a cache key is stored in Redis
+
+    Repository metadata changes in place, it is only cached with a ttl.
+    """
+    return bool(options['ttl']) or not L1_MUTABLE_PATHS.match(_path(key))
+
+
+def _missed(keys):
+    """Remember keys whose write or delete did not reach Redis."""
+    global missed
+    if missed is None:
+        return
+    missed.update(dict.fromkeys(keys))
+    if len(missed) > MAX_MISSED:
+        logging.error('LRU: more than {0} keys missed their update, Redis '
+                      'is no longer used: flush it, then restart the '
+                      'registry'.format(MAX_MISSED))
+        missed = None
+
+
+def _synced():
+    """Delete the keys which missed their update from Redis
+
+    Returns whether Redis can be read: it holds nothing older than the
+    storage.
+    """
+    if missed is None:
+        return False
+    if not missed:
+        return True
+    keys = list(missed)
+    try:
+        redis_conn.delete(*keys)
+    except redis.exceptions.ConnectionError as e:
+        _warn(e)
+        return False
+    # Keys which failed meanwhile are kept
+    for key in keys:
+        missed.pop(key, None)
+    return True
+
+
+def stats():
+    """Return the counters of the L1 cache, None if it is disabled."""
+    return l1.stats() if l1 is not None else None
+
+
+def set_sink(sink):
+    """Forward the metrics to sink, see Metrics."""
+    metrics.sink = sink
+
+
+def redis_info():
+    """Return the memory and eviction figures of the Redis server
+
+    With a cluster, the figures of every node, by node.
+    """
+    def figures(info):
+        if info is None:
+            return None
+        return dict((name, info.get(name)) for name in (
+            'used_memory', 'maxmemory', 'maxmemory_policy', 'evicted_keys',
+            'expired_keys', 'keyspace_hits', 'keyspace_misses'))
+    if redis_conn is None:
+        return None
+    try:
+        info = redis_conn.info()
+    except redis.exceptions.ConnectionError as e:
+        _warn(e)
+        return None
+    if isinstance(redis_conn, cluster.Cluster):
+        return dict((node, figures(node_info))
+                    for (node, node_info) in info.items())
+    return figures(info)
+
+
+def _l1_evicted(key):
+    metrics.incr('l1', _path(key), 'evictions')
+
+
+def _l1_discard(keys, prefix=False):
+    if l1 is not None:
+        l1.invalidate(keys, prefix)
+
+
+def _publish(keys, prefix=False):
+    if bus is not None and keys:
+        bus.publish(keys, prefix)
+
+
+def _bypassed(args):
+    """Whether the driver instance of a decorated method opted out."""
+    return not getattr(args[0], 'use_lru', True)
+
+
+def _published(f, args, keys, prefix=False):
+    """Call f, then tell every worker that keys changed."""
+    try:
+        return f(*args)
+    finally:
+        _publish(keys, prefix)
+
+
+def _l1_generation():
+    """Start listening to invalidations if needed, return the generation."""
+    if l1 is None:
+        return None
+    if bus is not None:
+        bus.start()
+    return l1.generation
+
+
+def forget(path):
+    """Drop path from the L1 cache of this worker
+
+    For read-modify-write cycles, which must not start from a copy of
+    this worker older than the content in Redis.
+    """
+    if l1 is not None:
+        l1.invalidate([cache_key(path)])
+
+
+def _warn(error):
+    # The breaker reports its own state changes, once
+    if not isinstance(error, breaker.CircuitOpen):
+        logging.warning("LRU: Redis connection error: {0}".format(error))
+
+
+def _bytes(content):
+    if isinstance(content, compat.bytes):
+        return content
+    return content.encode('utf8')
+
+
+def admits(content):
+    """Whether content is small enough to be cached."""
+    return len(content) <= options['max_value_size']
+
+
+def encode(content):
+    """Return the value stored for content: header, then payload."""
+    content = _bytes(content)
+    encoding = ENCODING_RAW
+    digest = hashlib.sha1(content).hexdigest().encode('ascii')
+    if len(content) >= options['compress_min_size']:
+        compressed = zlib.compress(content)
+        if len(compressed) < len(content):
+            content = compressed
+            encoding = ENCODING_ZLIB
+    return HEADER_MAGIC + encoding + digest + content
+
+
+def decode(value):
+    """Return the content stored in value."""
+    if value is None or not value.startswith(HEADER_MAGIC):
+        # Written before values had a header
+        return value
+    payload = value[HEADER_SIZE:]
+    if value[len(HEADER_MAGIC):len(HEADER_MAGIC) + 1] == ENCODING_ZLIB:
+        return zlib.decompress(payload)
+    return payload
+
+
+def _store(conn, key, value):
+    if options['ttl']:
+        conn.setex(key, options['ttl'], value)
+    else:
+        conn.set(key, value)
+
+
 def set(f):
     @functools.wraps(f)
     def wrapper(*args):
+        if _bypassed(args):
+            return f(*args)
         content = args[-1]
         key = args[-2]
         key = cache_key(key)
+        _l1_discard([key])
+        if not _cached(key):
+            return _published(f, args, [key])
+        if not _synced():
+            # Redis may hold contents older than the storage, this one too
+            _missed([key])
+            return _published(f, args, [key])
         try:
-            cached_content = get_by_key(key)
-            if cached_content and cached_content == content:
+            if not admits(content):
+                redis_conn.delete(key)
+                return _published(f, args, [key])
+            value = encode(content)
+            # Compare hashes, without transferring the cached content
+            header = redis_conn.getrange(key, 0, HEADER_SIZE - 1)
+            if header == value[:HEADER_SIZE]:
                 # If cached content is the same as what we are about to
                 # write, we don't need to write again.
                 return args[-2]
-            redis_conn.set(key, content)
+            _store(redis_conn, key, value)
+            metrics.incr('redis', args[-2], 'bytes_written', len(value))
         except redis.exceptions.ConnectionError as e:
-            logging.warning("LRU: Redis connection error: {0}".format(e))
+            _warn(e)
+            metrics.incr('redis', args[-2], 'errors')
+            # Redis may still hold the previous content
+            _missed([key])
 
-        return f(*args)
+        return _published(f, args, [key])
     if redis_conn is None:
         return f
     return wrapper
@@ -84,44 +638,212 @@ def set(f):
 def get(f):
     @functools.wraps(f)
     def wrapper(*args):
-        key = args[-1]
-        key = cache_key(key)
+        if _bypassed(args):
+            return f(*args)
+        path = args[-1]
+        key = cache_key(path)
+        generation = _l1_generation()
+        cache_l1 = l1 is not None and l1.admits(path)
+        if cache_l1:
+            content = l1.get(key)
+            if content is not None:
+                metrics.incr('l1', path, 'hits')
+                metrics.incr('l1', path, 'bytes_read', len(content))
+                return content
+            metrics.incr('l1', path, 'misses')
         content = get_by_key(key)
 
-        if content is not None:
-            return content
-        # Refresh cache
-        content = f(*args)
-        if content is not None:
-            try:
-                redis_conn.set(key, content)
-            except redis.exceptions.ConnectionError as e:
-                logging.warning("LRU: Redis connection error: {0}".format(e))
+        if content is None:
+            # Refresh cache
+            start = time.time()
+            content = f(*args)
+            metrics.timing('storage', path, time.time() - start)
+            if content is not None:
+                metrics.incr('storage', path, 'bytes_read', len(content))
+            if content is not None and admits(content) and _cached(key):
+                try:
+                    value = encode(content)
+                    _store(redis_conn, key, value)
+                    metrics.incr('redis', path, 'bytes_written', len(value))
+                except redis.exceptions.ConnectionError as e:
+                    _warn(e)
+                    metrics.incr('redis', path, 'errors')
+        if cache_l1 and content is not None:
+            l1.set(key, content, generation)
         return content
     if redis_conn is None:
         return f
     return wrapper
 
 
+def get_many(f):
+    """Decorate a get_many method: cached paths are fetched in one MGET."""
+    @functools.wraps(f)
+    def wrapper(*args):
+        if _bypassed(args):
+            return f(*args)
+        paths = list(args[-1])
+        contents = {}
+        generation = _l1_generation()
+        for path in paths:
+            if l1 is not None and l1.admits(path):
+                content = l1.get(cache_key(path))
+                if content is not None:
+                    contents[path] = content
+                    metrics.incr('l1', path, 'hits')
+                    metrics.incr('l1', path, 'bytes_read', len(content))
+                else:
+                    metrics.incr('l1', path, 'misses')
+        missing = [path for path in paths if path not in contents]
+        cached = get_by_keys([cache_key(path) for path in missing])
+        for path in missing:
+            content = cached.get(cache_key(path))
+            if content is not None:
+                contents[path] = content
+                if l1 is not None and l1.admits(path):
+                    l1.set(cache_key(path), content, generation)
+        missing = [path for path in paths if path not in contents]
+        if missing:
+            # f reads the storage only, the contents are cached here in one
+            # pipelined round trip
+            start = time.time()
+            fetched = f(*(args[:-1] + (missing,)))
+            elapsed = time.time() - start
+            for path in dict((path_class(path), path) for path in missing
+                             ).values():
+                metrics.timing('storage', path, elapsed)
+            for (path, content) in fetched.items():
+                metrics.incr('storage', path, 'bytes_read', len(content))
+                if l1 is not None and l1.admits(path):
+                    l1.set(cache_key(path), content, generation)
+            if fetched:
+                set_by_keys(dict((cache_key(path), content)
+                                 for (path, content) in fetched.items()))
+            contents.update(fetched)
+        return contents
+    if redis_conn is None:
+        return f
+    return wrapper
+
+
 def get_by_key(key):
+    path = _path(key)
+    if not _cached(key) or not _synced():
+        return None
+    start = time.time()
     try:
         content = redis_conn.get(key)
     except redis.exceptions.ConnectionError as e:
-        logging.warning("LRU: Redis connection error: {0}".format(e))
+        _warn(e)
+        metrics.incr('redis', path, 'errors')
+        return None
+    metrics.timing('redis', path, time.time() - start)
+    if content is None:
+        metrics.incr('redis', path, 'misses')
         return None
-    return content
+    metrics.incr('redis', path, 'hits')
+    metrics.incr('redis', path, 'bytes_read', len(content))
+    return decode(content)
+
+
+def get_by_keys(keys):
+    """Return the {key: content} of the keys found, in one round trip."""
+    keys = [key for key in keys if _cached(key)]
+    if not keys or not _synced():
+        return {}
+    start = time.time()
+    try:
+        values = redis_conn.mget(keys)
+    except redis.exceptions.ConnectionError as e:
+        _warn(e)
+        metrics.incr('redis', _path(keys[0]), 'errors')
+        return {}
+    elapsed = time.time() - start
+    # The batch latency is accounted once to each class of path it holds
+    for path in dict((path_class(_path(key)), _path(key)) for key in keys
+                     ).values():
+        metrics.timing('redis', path, elapsed)
+    contents = {}
+    for (key, value) in zip(keys, values):
+        if value is None:
+            metrics.incr('redis', _path(key), 'misses')
+            continue
+        metrics.incr('redis', _path(key), 'hits')
+        metrics.incr('redis', _path(key), 'bytes_read', len(value))
+        contents[key] = decode(value)
+    return contents
+
+
+def set_by_keys(contents):
+    """Cache a {key: content} dict, in one pipelined round trip."""
+    contents = dict((key, content) for (key, content) in contents.items()
+                    if _cached(key))
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        for (key, content) in contents.items():
+            if admits(content):
+                _store(pipe, key, encode(content))
+            else:
+                pipe.delete(key)
+        pipe.execute()
+    except redis.exceptions.ConnectionError as e:
+        _warn(e)
+        _missed(contents)
 
 
 def remove(f):
     @functools.wraps(f)
     def wrapper(*args):
+        if _bypassed(args):
+            return f(*args)
         key = args[-1]
         key = cache_key(key)
+        _l1_discard([key], prefix=True)
         try:
             redis_conn.delete(key)
         except redis.exceptions.ConnectionError as e:
-            logging.warning("LRU: Redis connection error: {0}".format(e))
-        return f(*args)
+            _warn(e)
+            _missed([key])
+        return _published(f, args, [key], prefix=True)
+    if redis_conn is None:
+        return f
+    return wrapper
+
+
+def put_many(f):
+    """Decorate a put_many method: the contents are cached in one pipeline."""
+    @functools.wraps(f)
+    def wrapper(*args):
+        if _bypassed(args):
+            return f(*args)
+        contents = dict((cache_key(path), content)
+                        for (path, content) in args[-1].items())
+        _l1_discard(list(contents))
+        if _synced():
+            set_by_keys(contents)
+        else:
+            # Redis may hold contents older than the storage, these too
+            _missed([key for key in contents if _cached(key)])
+        return _published(f, args, list(contents))
+    if redis_conn is None:
+        return f
+    return wrapper
+
+
+def remove_many(f):
+    @functools.wraps(f)
+    def wrapper(*args):
+        if _bypassed(args):
+            return f(*args)
+        keys = [cache_key(key) for key in args[-1]]
+        _l1_discard(keys, prefix=True)
+        try:
+            if keys:
+                redis_conn.delete(*keys)
+        except redis.exceptions.ConnectionError as e:
+            _warn(e)
+            _missed(keys)
+        return _published(f, args, keys, prefix=True)
     if redis_conn is None:
         return f
     return wrapper
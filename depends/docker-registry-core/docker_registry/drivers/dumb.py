@@ -24,6 +24,7 @@ Should only be used for inspiration and tests.
 
 """
 
+from ..core import async_driver
 from ..core import compat
 from ..core import driver
 from ..core import exceptions
@@ -131,3 +132,14 @@ class Storage(driver.Base):
             raise exceptions.FileNotFoundError('%s is not there' % path)
 
         return ls
+
+
+class AsyncStorage(async_driver.Adapter):
+
+    """Asynchronous flavor, memory never blocks so calls complete at once."""
+
+    def __init__(self, path=None, config=None):
+        super(AsyncStorage, self).__init__(Storage(path, config))
+
+    def _submit(self, fn, *args):
+        return async_driver.done(fn, *args)
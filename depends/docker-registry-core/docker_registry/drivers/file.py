@@ -20,14 +20,22 @@ docker_registry.drivers.file
 
 This is a simple filesystem based driver.
 
+Images can be spread into sharded directories (`storage_shard_depth`), so
+that a large registry doesn't end up with millions of entries in a single
+directory. Images stored before sharding was enabled are still read from
+their flat location until they are moved with `shard_image`.
+
 """
 
+import errno
 import os
 import shutil
 
+from ..core import async_driver
 from ..core import driver
 from ..core import exceptions
 from ..core import lru
+import gevent
 
 
 class Storage(driver.Base):
@@ -36,18 +44,64 @@ class Storage(driver.Base):
 
     def __init__(self, path=None, config=None):
         self._root_path = path or './tmp'
+        if config and config.storage_shard_depth:
+            self.images_shard_depth = int(config.storage_shard_depth)
+
+    def _batch(self, fn, items):
+        """Call fn on every item from gevent's thread pool.
+
+        Returns {item: result}. fn only does disk I/O: the cache is handled
+        by the decorators of the batch methods, from the calling greenlet.
+        """
+        items = list(items)
+        threadpool = gevent.get_hub().threadpool
+        return dict(zip(items, threadpool.map(fn, items)))
 
     def _init_path(self, path=None, create=False):
         path = os.path.join(self._root_path, path) if path else self._root_path
         if create is True:
             dirname = os.path.dirname(path)
             if not os.path.exists(dirname):
-                os.makedirs(dirname)
+                try:
+                    os.makedirs(dirname)
+                except OSError as e:
+                    # Created by a concurrent write (see _batch)
+                    if e.errno != errno.EEXIST:
+                        raise
         return path
 
+    def _legacy_path(self, path):
+        """Return the flat location of a sharded image path, or None."""
+        depth = self.images_shard_depth
+        if not depth or not path:
+            return None
+        parts = path.split('/')
+        if len(parts) < depth + 2 or parts[0] != self.images:
+            return None
+        if [p for p in parts[1:depth + 1] if len(p) != 2]:
+            return None
+        return '/'.join(parts[:1] + parts[depth + 1:])
+
+    def _read_path(self, path):
+        """Like _init_path, with a fallback to the flat layout
+
+        Images which have not been moved to their shard yet are read from
+        their flat location.
+        """
+        full_path = self._init_path(path)
+        legacy_path = self._legacy_path(path)
+        if legacy_path and not os.path.exists(full_path):
+            legacy_path = self._init_path(legacy_path)
+            if os.path.exists(legacy_path):
+                return legacy_path
+        return full_path
+
     @lru.get
     def get_content(self, path):
-        path = self._init_path(path)
+        return self._get_content(path)
+
+    def _get_content(self, path):
+        path = self._read_path(path)
         try:
             with open(path, mode='rb') as f:
                 d = f.read()
@@ -58,13 +112,16 @@ class Storage(driver.Base):
 
     @lru.set
     def put_content(self, path, content):
+        return self._put_content(path, content)
+
+    def _put_content(self, path, content):
         path = self._init_path(path, create=True)
         with open(path, mode='wb') as f:
             f.write(content)
         return path
 
     def stream_read(self, path, bytes_range=None):
-        path = self._init_path(path)
+        path = self._read_path(path)
         nb_bytes = 0
         total_size = 0
         try:
@@ -107,11 +164,48 @@ class Storage(driver.Base):
             except IOError:
                 pass
 
+    def _list_images(self, path, depth):
+        for d in os.listdir(self._init_path(path)):
+            if depth and len(d) == 2:
+                for image_path in self._list_images(
+                        '%s/%s' % (path, d), depth - 1):
+                    yield image_path
+            elif not depth:
+                yield '%s/%s' % (path, d)
+            elif path == self.images and not os.path.exists(
+                    self._init_path(self._image_path(d))):
+                # An image which is still stored flat; once it has a shard
+                # directory the sharded copy is the one listed
+                yield '%s/%s' % (path, d)
+
+    def flat_images(self):
+        """Yield the ids of the images which still have flat files.
+
+        Unlike list_directory, this includes the images partly moved to
+        their shard already, so that the migration can complete them.
+        """
+        try:
+            names = os.listdir(self._init_path(self.images))
+        except OSError:
+            raise exceptions.FileNotFoundError(
+                '%s is not there' % self.images)
+        for d in names:
+            if not self.images_shard_depth or len(d) != 2:
+                yield d
+
     def list_directory(self, path=None):
+        if path == self.images and self.images_shard_depth:
+            try:
+                for image_path in self._list_images(
+                        path, self.images_shard_depth):
+                    yield image_path
+            except OSError:
+                raise exceptions.FileNotFoundError('%s is not there' % path)
+            return
         prefix = ''
         if path:
             prefix = '%s/' % path
-        path = self._init_path(path)
+        path = self._read_path(path)
         exists = False
         try:
             for d in os.listdir(path):
@@ -123,23 +217,156 @@ class Storage(driver.Base):
             raise exceptions.FileNotFoundError('%s is not there' % path)
 
     def exists(self, path):
-        path = self._init_path(path)
+        path = self._read_path(path)
         return os.path.exists(path)
 
     @lru.remove
     def remove(self, path):
-        path = self._init_path(path)
-        if os.path.isdir(path):
-            shutil.rmtree(path)
-            return
-        try:
-            os.remove(path)
-        except OSError:
+        return self._remove(path)
+
+    def _remove(self, path):
+        paths = [path]
+        legacy_path = self._legacy_path(path)
+        if legacy_path:
+            paths.append(legacy_path)
+        removed = False
+        for path in paths:
+            path = self._init_path(path)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+                removed = True
+                continue
+            try:
+                os.remove(path)
+                removed = True
+            except OSError:
+                pass
+        if not removed:
             raise exceptions.FileNotFoundError('%s is not there' % path)
 
+    def move(self, src, dst):
+        src = self._read_path(src)
+        dst = self._init_path(dst, create=True)
+        try:
+            os.rename(src, dst)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            raise exceptions.FileNotFoundError('%s is not there' % src)
+
     def get_size(self, path):
-        path = self._init_path(path)
+        path = self._read_path(path)
         try:
             return os.path.getsize(path)
         except OSError:
             raise exceptions.FileNotFoundError('%s is not there' % path)
+
+    def stat(self, path):
+        path = self._read_path(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        # Same weak validator as most web servers: mtime and size
+        etag = '{0:x}-{1:x}'.format(int(st.st_mtime), st.st_size)
+        return driver.Stat(st.st_size, st.st_mtime, etag)
+
+    @lru.get_many
+    def get_many(self, paths):
+        def get(path):
+            try:
+                return self._get_content(path)
+            except exceptions.FileNotFoundError:
+                return None
+        contents = self._batch(get, paths)
+        return dict((k, v) for (k, v) in contents.items() if v is not None)
+
+    @lru.put_many
+    def put_many(self, contents):
+        self._batch(lambda path: self._put_content(path, contents[path]),
+                    contents.keys())
+
+    def exists_many(self, paths):
+        return self._batch(self.exists, paths)
+
+    @lru.remove_many
+    def remove_many(self, paths):
+        def remove(path):
+            try:
+                self._remove(path)
+            except exceptions.FileNotFoundError:
+                pass
+        self._batch(remove, paths)
+
+    def shard_image(self, image_id):
+        """Move an image from the flat layout to its shard
+
+        Files are hard linked into the shard then unlinked, so readers always
+        find them in one of the two locations, and a file written to the
+        shard in the meantime is never overwritten. Returns the number of
+        files moved.
+        """
+        image_path = self.image_path(image_id)
+        legacy_path = self._legacy_path(image_path)
+        if not legacy_path:
+            return 0
+        src = self._init_path(legacy_path)
+        dst = self._init_path(image_path)
+        moved = 0
+        if not os.path.isdir(src):
+            return moved
+        if not os.path.exists(dst):
+            os.makedirs(dst)
+        for fname in os.listdir(src):
+            src_file = os.path.join(src, fname)
+            try:
+                os.link(src_file, os.path.join(dst, fname))
+                moved += 1
+            except OSError as e:
+                # A newer copy was written to the shard already
+                if e.errno != errno.EEXIST:
+                    raise
+            os.remove(src_file)
+        os.rmdir(src)
+        return moved
+
+
+class AsyncStorage(async_driver.Adapter):
+
+    """Asynchronous flavor of the filesystem driver
+
+    gevent doesn't make disk I/O cooperative, so layer reads and writes run
+    on gevent's thread pool instead of blocking the whole worker. Other
+    calls touch small files and may go through the cache, they run in
+    greenlets.
+    """
+
+    def __init__(self, path=None, config=None):
+        super(AsyncStorage, self).__init__(Storage(path, config))
+
+    def stream_read(self, path, bytes_range=None):
+        threadpool = gevent.get_hub().threadpool
+        chunks = self._storage.stream_read(path, bytes_range)
+        while True:
+            # stream_read never yields empty chunks
+            buf = threadpool.apply(next, (chunks, None))
+            if buf is None:
+                break
+            yield buf
+
+    def stream_write(self, path, fp):
+        return gevent.spawn(self._stream_write, path, fp)
+
+    def _stream_write(self, path, fp):
+        threadpool = gevent.get_hub().threadpool
+        path = self._storage._init_path(path, create=True)
+        with open(path, mode='wb') as f:
+            try:
+                while True:
+                    # Read from the greenlet, fp is usually a gevent socket
+                    buf = fp.read(self.buffer_size)
+                    if not buf:
+                        break
+                    threadpool.apply(f.write, (buf,))
+            except IOError:
+                pass
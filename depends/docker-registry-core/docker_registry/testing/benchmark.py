@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Docker.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+docker_registry.testing.benchmark
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Performance measurements of a storage driver, the counterpart of
+`docker_registry.testing.Driver` which only checks correctness.
+
+Results are a JSON document, so that runs of a driver before and after a
+change can be compared (`--compare`):
+
+    $ python -m docker_registry.testing.benchmark --driver file \\
+        --path /tmp/bench --output before.json
+    $ python -m docker_registry.testing.benchmark --driver file \\
+        --path /tmp/bench --compare before.json
+
+Drivers running against `mock_boto` (`--mock-boto`) measure the driver
+overhead only.
+"""
+
+from __future__ import print_function
+
+import json
+import random
+import string
+import sys
+import time
+
+from ..core import driver
+from ..core import exceptions
+from . import utils
+import gevent
+import gevent.pool
+
+MB = 1024 * 1024
+
+# The benchmarks run by default, in order
+BENCHMARKS = ['small', 'stream', 'range', 'list', 'concurrency']
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Summarize latency samples (seconds): mean, max and percentiles."""
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    summary = {'count': len(samples),
+               'mean': sum(samples) / len(samples),
+               'max': samples[-1]}
+    for point in points:
+        # Nearest rank
+        index = max(int(round(point / 100.0 * len(samples))) - 1, 0)
+        summary['p{0}'.format(point)] = samples[index]
+    return summary
+
+
+class PatternReader(object):
+    """File-like object of `size' bytes, generated on the fly
+
+    Lets streams of several GB be written without holding them in memory.
+    """
+
+    def __init__(self, size, block=None):
+        self.size = size
+        self.pos = 0
+        self._block = block or ''.join(
+            random.choice(string.ascii_letters) for i in range(4096)) * 256
+
+    def read(self, size=-1):
+        left = self.size - self.pos
+        if size < 0 or size > left:
+            size = left
+        bufs = []
+        while size > 0:
+            offset = self.pos % len(self._block)
+            buf = self._block[offset:offset + size]
+            bufs.append(buf)
+            self.pos += len(buf)
+            size -= len(buf)
+        return ''.join(bufs)
+
+
+class Benchmark(object):
+
+    """Measure the performance of a storage driver
+
+    Every benchmark works under its own random prefix, removed afterwards.
+    Sizes and counts are attributes, so that a driver package can tune
+    them to what its backend can take.
+    """
+
+    # Objects of the latency benchmarks
+    small_size = 1024
+    small_count = 200
+    # Objects of the throughput benchmarks
+    stream_sizes = [1 * MB, 16 * MB, 128 * MB]
+    # Byte range reads, on the largest stream size
+    range_size = 1 * MB
+    range_count = 50
+    # Entries of the directory listed
+    list_count = 10 ** 5
+    # Greenlets doing small reads at once, and reads done by each level
+    concurrency = [1, 4, 16, 64]
+    concurrency_ops = 1000
+
+    def __init__(self, scheme=None, path=None, config=None):
+        self.scheme = scheme
+        self.path = path
+        self.config = config or utils.Config({})
+
+    def setUp(self):
+        storage = driver.fetch(self.scheme)
+        self._storage = storage(self.path, self.config)
+        self.prefix = 'benchmark/{0}'.format(self.gen_random_string())
+
+    def tearDown(self):
+        try:
+            self._storage.remove(self.prefix)
+        except exceptions.FileNotFoundError:
+            pass
+
+    def gen_random_string(self, length=16):
+        return ''.join([random.choice(string.ascii_lowercase + string.digits)
+                        for x in range(length)])
+
+    def _timed(self, fn, *args):
+        start = time.time()
+        fn(*args)
+        return time.time() - start
+
+    def _path(self, *parts):
+        return '/'.join((self.prefix,) + tuple(str(p) for p in parts))
+
+    def bench_small(self):
+        """Latency of put_content and get_content on small objects."""
+        content = self.gen_random_string(self.small_size)
+        paths = [self._path('small', i) for i in range(self.small_count)]
+        put = [self._timed(self._storage.put_content, path, content)
+               for path in paths]
+        get = [self._timed(self._storage.get_content, path)
+               for path in paths]
+        return {'size': self.small_size,
+                'put_content': percentiles(put),
+                'get_content': percentiles(get)}
+
+    def bench_stream(self):
+        """Throughput (bytes/s) of stream_write and stream_read."""
+        results = {}
+        for size in self.stream_sizes:
+            path = self._path('stream', size)
+            write = self._timed(
+                self._storage.stream_write, path, PatternReader(size))
+
+            def read_all():
+                for buf in self._storage.stream_read(path):
+                    pass
+            read = self._timed(read_all)
+            results[str(size)] = {
+                'stream_write': size / max(write, 1e-9),
+                'stream_read': size / max(read, 1e-9)}
+        return results
+
+    def bench_range(self):
+        """Latency of byte range reads at random offsets."""
+        if not self._storage.supports_bytes_range:
+            return {'supported': False}
+        size = max(self.stream_sizes)
+        path = self._path('range')
+        self._storage.stream_write(path, PatternReader(size))
+        length = min(self.range_size, size)
+
+        def read(offset):
+            for buf in self._storage.stream_read(
+                    path, (offset, offset + length - 1)):
+                pass
+        samples = [self._timed(read, random.randint(0, size - length))
+                   for i in range(self.range_count)]
+        return {'supported': True, 'size': length,
+                'stream_read': percentiles(samples)}
+
+    def bench_list(self):
+        """Time to list a directory of list_count entries."""
+        directory = self._path('list')
+        start = time.time()
+        self._storage.put_many(dict(
+            (self._path('list', i), '') for i in range(self.list_count)))
+        populate = time.time() - start
+        start = time.time()
+        count = len(list(self._storage.list_directory(directory)))
+        return {'entries': count, 'populate': populate,
+                'list_directory': time.time() - start}
+
+    def bench_concurrency(self):
+        """Small reads per second with an increasing number of greenlets."""
+        content = self.gen_random_string(self.small_size)
+        paths = [self._path('concurrency', i) for i in range(64)]
+        self._storage.put_many(dict((path, content) for path in paths))
+        results = {}
+        for level in self.concurrency:
+            pool = gevent.pool.Pool(level)
+            start = time.time()
+            for i in range(self.concurrency_ops):
+                pool.spawn(self._storage.get_content, paths[i % len(paths)])
+            pool.join()
+            results[str(level)] = self.concurrency_ops / max(
+                time.time() - start, 1e-9)
+        return results
+
+    def run(self, benchmarks=None):
+        """Run benchmarks (defaults to all) and return their results."""
+        results = {}
+        for name in benchmarks or BENCHMARKS:
+            self.setUp()
+            try:
+                results[name] = getattr(self, 'bench_' + name)()
+            finally:
+                self.tearDown()
+        return {'driver': self.scheme, 'time': int(time.time()),
+                'results': results}
+
+
+def compare(before, after):
+    """Return the after/before ratio of every measure of two runs."""
+    def ratios(old, new):
+        if isinstance(new, dict):
+            return dict((k, ratios(old[k], new[k]))
+                        for k in new if isinstance(old, dict) and k in old)
+        if isinstance(new, (int, float)) and old:
+            return float(new) / old
+        return None
+    return ratios(before['results'], after['results'])
+
+
+def main(argv=None):
+    # Not in the standard library of Python 2.6, only needed here
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Measure the performance of a storage driver')
+    parser.add_argument('--driver', required=True, help='storage driver')
+    parser.add_argument('--path', help='storage path')
+    parser.add_argument('--config', default='{}',
+                        help='driver configuration, as JSON')
+    parser.add_argument('--mock-boto', action='store_true',
+                        help='run boto based drivers against mock_boto')
+    parser.add_argument('--only', action='append', choices=BENCHMARKS,
+                        help='benchmark to run (repeatable)')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='stream sizes, in MB')
+    parser.add_argument('--list-count', type=int)
+    parser.add_argument('--concurrency', type=int, nargs='+')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare',
+                        help='results of a previous run to compare with')
+    args = parser.parse_args(argv)
+    if args.mock_boto:
+        from . import mock_boto  # noqa
+    bench = Benchmark(args.driver, args.path,
+                      utils.Config(json.loads(args.config)))
+    if args.sizes:
+        bench.stream_sizes = [size * MB for size in args.sizes]
+    if args.list_count is not None:
+        bench.list_count = args.list_count
+    if args.concurrency:
+        bench.concurrency = args.concurrency
+    results = bench.run(args.only)
+    if args.compare:
+        with open(args.compare) as f:
+            results['compared_to'] = compare(json.load(f), results)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
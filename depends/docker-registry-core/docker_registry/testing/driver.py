@@ -191,6 +191,57 @@ class Driver(object):
         except Exception:
             pass
 
+    # Moves
+    def test_move(self):
+        dirname = self.gen_random_string()
+        src = '%s/%s' % (dirname, self.gen_random_string())
+        dst = '%s/%s' % (dirname, self.gen_random_string())
+        content = self.gen_random_string(1024 * 64).encode('utf8')
+        self._storage.stream_write(src, compat.StringIO(content))
+        self._storage.move(src, dst)
+        assert not self._storage.exists(src)
+        assert b''.join(self._storage.stream_read(dst)) == content
+
+    @tools.raises(exceptions.FileNotFoundError)
+    def test_move_inexistent(self):
+        self._storage.move(self.gen_random_string(),
+                           self.gen_random_string())
+
+    # Batches
+    def test_put_get_many(self):
+        contents = dict((self.gen_random_string(),
+                         self.gen_random_string().encode('utf8'))
+                        for i in range(5))
+        self._storage.put_many(contents)
+        missing = self.gen_random_string()
+        assert self._storage.get_many(list(contents) + [missing]) == contents
+        for path, content in contents.items():
+            assert self._storage.get_content(path) == content
+
+    def test_exists_many(self):
+        filename1 = self.gen_random_string()
+        filename2 = self.gen_random_string()
+        self._storage.put_content(filename1, b'')
+        assert self._storage.exists_many([filename1, filename2]) == {
+            filename1: True, filename2: False}
+
+    def test_remove_many(self):
+        filename1 = self.gen_random_string()
+        filename2 = self.gen_random_string()
+        filename3 = self.gen_random_string()
+        content = self.gen_random_string().encode('utf8')
+        self._storage.put_many({filename1: content, filename2: content})
+        assert self._storage.get_content(filename1) == content
+        self._storage.remove_many([filename1, filename2, filename3])
+        assert not self._storage.exists(filename1)
+        assert not self._storage.exists(filename2)
+        # Check the lru is ok
+        try:
+            self._storage.get_content(filename1)
+            assert False
+        except exceptions.FileNotFoundError:
+            pass
+
     @tools.raises(exceptions.FileNotFoundError)
     def test_remove_inexistent(self):
         filename = self.gen_random_string()
@@ -206,6 +257,18 @@ class Driver(object):
         filename = self.gen_random_string()
         self._storage.get_size(filename)
 
+    def test_stat(self):
+        filename = self.gen_random_string()
+        content = self.gen_random_string(1024)
+        self._storage.put_content(filename, content)
+        stat = self._storage.stat(filename)
+        assert stat.size == 1024
+        self._storage.remove(filename)
+
+    def test_stat_inexistent(self):
+        filename = self.gen_random_string()
+        assert self._storage.stat(filename) is None
+
     def test_stream(self):
         filename = self.gen_random_string()
         # test 7MB
@@ -356,6 +419,16 @@ class Driver(object):
         assert not self._storage.exists(p)
         p = self._storage.tag_path(namespace, repository, tag)
         assert not self._storage.exists(p)
+        p = self._storage.tag_manifest_path(namespace, repository)
+        assert not self._storage.exists(p)
+        p = self._storage.catalog_path()
+        assert not self._storage.exists(p)
+        p = self._storage.catalog_path(namespace)
+        assert not self._storage.exists(p)
+        p = self._storage.catalog_path(namespace, repository)
+        assert not self._storage.exists(p)
+        p = self._storage.catalog_complete_path()
+        assert not self._storage.exists(p)
         p = self._storage.repository_json_path(namespace, repository)
         assert not self._storage.exists(p)
         p = self._storage.repository_tag_json_path(namespace, repository, tag)
@@ -18,11 +18,15 @@
 XXX this mock is crass and break gcs.
 Look into moto instead.'''
 
+import email.utils
+import hashlib
+
 from . import mock_dict
 from . import utils
 import boto.s3.bucket
 import boto.s3.connection
 import boto.s3.key
+import boto.s3.multidelete
 import six
 
 Bucket__init__ = boto.s3.bucket.Bucket.__init__
@@ -87,8 +91,23 @@ class Bucket(boto.s3.bucket.Bucket):
             k = Key(self)
             k.name = key_name
             k.size = len(value)
+            k.etag = '"{0}"'.format(hashlib.md5(value).hexdigest())
+            k.last_modified = email.utils.formatdate(usegmt=True)
             return k
 
+    def copy_key(self, new_key_name, src_bucket_name, src_key_name,
+                 **kwargs):
+        Bucket._bucket[self.name][new_key_name] = (
+            Bucket._bucket[src_bucket_name][src_key_name])
+
+    def delete_keys(self, keys, **kwargs):
+        result = boto.s3.multidelete.MultiDeleteResult(self)
+        for key_name in keys:
+            if self._bucket_dict and key_name in self._bucket_dict:
+                del self._bucket_dict[key_name]
+            result.deleted.append(boto.s3.multidelete.Deleted(key_name))
+        return result
+
     def initiate_multipart_upload(self, key_name, **kwargs):
         # Pass key_name to MultiPartUpload
         mp = MultiPartUpload(self)
@@ -120,8 +139,20 @@ class Key(boto.s3.key.Key):
         fp.write(value[int(min_cur):int(max_cur) + 1])
         fp.flush()
 
+    def open_read(self, headers=None, **kwargs):
+        if headers and 'Range' in headers:
+            min_cur, max_cur = (headers['Range'].replace('bytes=', '')
+                                .split('-'))
+            self._last_position = int(min_cur)
+            self._range_end = int(max_cur) + 1
+
     def read(self, buffer_size):
         # fetch read status
         lp = getattr(self, '_last_position', 0)
-        self._last_position = lp + buffer_size
-        return self.bucket._bucket_dict[self.name][lp:lp + buffer_size]
+        end = min(lp + buffer_size, getattr(self, '_range_end', lp +
+                                            buffer_size))
+        self._last_position = end
+        return self.bucket._bucket_dict[self.name][lp:end]
+
+    def close(self, fast=False):
+        pass
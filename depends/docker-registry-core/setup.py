@@ -34,6 +34,10 @@ if ver < (2, 6):
 requirements_txt = open('./requirements/main.txt')
 requirements = [line for line in requirements_txt]
 
+if ver < (2, 7):
+    # Python 2.6 requires additional libraries
+    requirements.insert(0, 'ordereddict==1.1')
+
 # Using this will relax dependencies to semver major matching
 if 'DEPS' in os.environ and os.environ['DEPS'].lower() == 'loose':
     loose = []
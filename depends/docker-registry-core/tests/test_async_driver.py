@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Docker.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from nose import tools
+
+from docker_registry.core import async_driver
+from docker_registry.core import exceptions
+import docker_registry.testing as testing
+
+
+class AsyncDriver(testing.Driver):
+
+    """Run the driver compliance tests through the adapters."""
+
+    def setUp(self):
+        storage = async_driver.fetch(self.scheme)
+        self._async_storage = storage(self.path, self.config)
+        self._storage = async_driver.SyncAdapter(self._async_storage)
+
+    def test_futures(self):
+        filename = self.gen_random_string()
+        futures = [self._async_storage.put_content(
+            '{0}/{1}'.format(filename, i), str(i)) for i in range(5)]
+        [f.get() for f in futures]
+        futures = [self._async_storage.get_content(
+            '{0}/{1}'.format(filename, i)) for i in range(5)]
+        assert [f.get() for f in futures] == [str(i) for i in range(5)]
+        self._async_storage.remove(filename).get()
+
+    @tools.raises(exceptions.FileNotFoundError)
+    def test_future_error(self):
+        filename = self.gen_random_string()
+        self._async_storage.get_content(filename).get()
+
+
+class TestAsyncDriverDumb(AsyncDriver):
+    def __init__(self):
+        self.scheme = 'dumb'
+        self.path = ''
+        self.config = testing.Config({})
+
+
+class TestAsyncDriverFile(AsyncDriver):
+    def __init__(self):
+        self.scheme = 'file'
+        self.path = ''
+        self.config = testing.Config({})
+
+    def test_native(self):
+        assert self._async_storage.__class__.__name__ == 'AsyncStorage'
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Docker.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+from docker_registry.testing import benchmark
+
+
+class SmallBenchmark(benchmark.Benchmark):
+
+    small_count = 10
+    stream_sizes = [1024, 300 * 1024]
+    range_size = 1000
+    range_count = 5
+    list_count = 50
+    concurrency = [1, 8]
+    concurrency_ops = 20
+
+
+class TestBenchmark(object):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_run(self):
+        results = SmallBenchmark('file', self.path).run()
+        assert results['driver'] == 'file'
+        results = results['results']
+        assert sorted(results) == sorted(benchmark.BENCHMARKS)
+        assert results['small']['get_content']['count'] == 10
+        assert sorted(results['stream']) == ['1024', '307200']
+        assert results['range']['supported']
+        assert results['list']['entries'] == 50
+        assert sorted(results['concurrency']) == ['1', '8']
+        # the benchmarks clean up after themselves
+        assert os.listdir(os.path.join(self.path, 'benchmark')) == []
+
+    def test_main(self):
+        output = os.path.join(self.path, 'results.json')
+        args = ['--driver', 'dumb', '--only', 'small', '--output', output]
+        benchmark.main(args)
+        with open(output) as f:
+            before = json.load(f)
+        assert sorted(before['results']) == ['small']
+        benchmark.main(args + ['--compare', output])
+        with open(output) as f:
+            after = json.load(f)
+        ratios = after['compared_to']['small']['put_content']
+        assert ratios['count'] == 1.0
+
+    def test_percentiles(self):
+        summary = benchmark.percentiles(range(1, 101))
+        assert summary['p50'] == 50
+        assert summary['p99'] == 99
+        assert summary['max'] == 100
+
+    def test_pattern_reader(self):
+        reader = benchmark.PatternReader(10, block='abc')
+        assert reader.read(4) == 'abca'
+        assert reader.read() == 'bcabca'
+        assert reader.read(4) == ''
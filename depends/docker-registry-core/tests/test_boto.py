@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Docker.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import gevent
+from nose import tools
+
+from docker_registry.core import boto as coreboto
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(object):
+
+    def setUp(self):
+        self.pool = coreboto.ConnectionPool(max_idle=3, max_idle_per_host=2,
+                                            idle_timeout=60)
+
+    def test_reuse(self):
+        assert self.pool.get_http_connection('a', 443, True) is None
+        conn = FakeConnection()
+        self.pool.put_http_connection('a', 443, True, conn)
+        assert self.pool.get_http_connection('a', 443, True) is conn
+        stats = self.pool.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+
+    def test_per_host_cap(self):
+        conns = [FakeConnection() for i in range(3)]
+        for conn in conns:
+            self.pool.put_http_connection('a', 443, True, conn)
+        # The oldest connection was closed to stay under the cap
+        assert conns[0].closed
+        assert not conns[1].closed
+        assert self.pool.stats()['hosts'] == {'a:443': 2}
+        assert self.pool.stats()['evictions'] == 1
+
+    def test_size_limit(self):
+        for host in ['a', 'b']:
+            for i in range(2):
+                self.pool.put_http_connection(host, 443, True,
+                                              FakeConnection())
+        stats = self.pool.stats()
+        assert stats['size'] == 3
+        assert stats['evictions'] == 1
+
+    def test_idle_eviction(self):
+        conn = FakeConnection()
+        self.pool.put_http_connection('a', 443, True, conn)
+        self.pool.idle_timeout = 0
+        time.sleep(0.01)
+        assert self.pool.get_http_connection('a', 443, True) is None
+        assert conn.closed
+
+
+class FakeKey(object):
+
+    """Serves ranged reads of a string, failing the first `failures' ones."""
+
+    def __init__(self, data, failures=0):
+        self.data = data
+        self.size = len(data)
+        self.resp = None
+        self.failures = [failures]
+        self.ranges = []
+
+    def open_read(self, headers=None):
+        start, end = headers['Range'].replace('bytes=', '').split('-')
+        self.ranges.append((int(start), int(end)))
+        self._cursor = int(start)
+        self._end = int(end) + 1
+
+    def read(self, size):
+        if self.failures[0]:
+            self.failures[0] -= 1
+            raise IOError('connection reset')
+        buf = self.data[self._cursor:min(self._cursor + size, self._end)]
+        self._cursor += len(buf)
+        return buf
+
+    def close(self, fast=False):
+        pass
+
+
+class SmallParallelKey(coreboto.ParallelKey):
+    MIN_PART_SIZE = 10
+    MAX_BUFFER = 96
+    MAX_CONCURRENCY = 3
+    buffer_size = 4
+
+
+class TestParallelKey(object):
+
+    def read_all(self, key):
+        data = ''
+        while True:
+            buf = key.read(7)
+            if not buf:
+                return data
+            assert len(buf) <= 7
+            data += buf
+
+    def test_read(self):
+        data = ''.join(chr(ord('a') + i % 26) for i in range(95))
+        key = SmallParallelKey(FakeKey(data))
+        assert len(key._parts) == 3
+        assert self.read_all(key) == data
+
+    def test_range(self):
+        data = ''.join(chr(ord('a') + i % 26) for i in range(95))
+        fake_key = FakeKey(data)
+        key = SmallParallelKey(fake_key, (13, 80))
+        assert self.read_all(key) == data[13:81]
+        assert sorted(fake_key.ranges) == [(13, 35), (36, 58), (59, 80)]
+
+    def test_range_buffer_bound(self):
+        data = 'x' * 200
+        key = SmallParallelKey(FakeKey(data), (50, 149))
+        gevent.sleep(0.01)
+        received = sum(part.received for part in key._parts)
+        assert received <= max(key.MAX_BUFFER, key._parts[0].size)
+        assert self.read_all(key) == data[50:150]
+
+    def test_retry(self):
+        data = 'x' * 95
+        key = SmallParallelKey(FakeKey(data, failures=2))
+        assert self.read_all(key) == data
+
+    @tools.raises(IOError)
+    def test_error(self):
+        key = SmallParallelKey(FakeKey('x' * 95, failures=100))
+        self.read_all(key)
+
+    def test_buffer_bound(self):
+        class TightParallelKey(SmallParallelKey):
+            MAX_BUFFER = 20
+
+        data = 'x' * 95
+        key = TightParallelKey(FakeKey(data))
+        # MIN_PART_SIZE parts, two at a time within MAX_BUFFER
+        assert key._parts[0].size == key.MIN_PART_SIZE
+        assert key.window == 2
+        assert len(key._workers) == 2
+        gevent.sleep(0.01)
+        received = sum(part.received for part in key._parts)
+        assert received <= max(key.MAX_BUFFER, key._parts[0].size)
+        assert self.read_all(key) == data
+
+    def test_part_size(self):
+        cls = coreboto.ParallelKey
+        # Small objects are still split across connections
+        assert cls._part_size(4 * 1024 * 1024) == 1024 * 1024
+        # Large ones in parts lasting PART_DURATION at the known throughput
+        assert cls._part_size(10 ** 12) == min(
+            cls.MAX_PART_SIZE, cls.MAX_BUFFER // cls.MAX_CONCURRENCY,
+            int(cls.throughput * cls.PART_DURATION))
+
+    def test_fast_link(self):
+        cls = coreboto.ParallelKey
+        fake_key = FakeKey('')
+        fake_key.size = 10 ** 10
+        throughput = cls.throughput
+        try:
+            cls.throughput = 10 ** 9
+            key = cls(fake_key)
+            key.close()
+        finally:
+            cls.throughput = throughput
+        # parts are capped so that every connection fits in MAX_BUFFER
+        assert key._parts[0].size == cls.MAX_BUFFER // cls.MAX_CONCURRENCY
+        assert key.window == cls.MAX_CONCURRENCY
+        assert len(key._workers) == cls.MAX_CONCURRENCY
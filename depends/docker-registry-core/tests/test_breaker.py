@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Docker.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from nose import tools
+import redis
+
+from docker_registry.core import breaker
+
+
+def fail(error):
+    raise error
+
+
+class TestBreaker(object):
+
+    def setUp(self):
+        self.breaker = breaker.Breaker('test', failures=3, cooldown=10)
+
+    def test_trip(self):
+        for i in range(3):
+            assert self.breaker.state == 'closed'
+            tools.assert_raises(
+                redis.exceptions.ConnectionError, self.breaker.call, fail,
+                redis.exceptions.ConnectionError('down'))
+        assert self.breaker.state == 'open'
+        tools.assert_raises(breaker.CircuitOpen, self.breaker.call, len, '')
+        stats = self.breaker.stats()
+        assert stats['trips'] == 1
+        assert stats['refused'] == 1
+        assert stats['last_error'] == 'down'
+
+    def test_recover(self):
+        for i in range(3):
+            self.breaker.failure('down', now=100)
+        assert not self.breaker.allow(now=105)
+        # a single probe after the cooldown
+        assert self.breaker.allow(now=111)
+        assert not self.breaker.allow(now=111)
+        self.breaker.failure('down', now=111)
+        assert self.breaker.state == 'open'
+        assert self.breaker.allow(now=122)
+        self.breaker.success()
+        assert self.breaker.state == 'closed'
+        assert self.breaker.allow()
+
+    def test_timeout(self):
+        # timeouts are raised as connection errors
+        tools.assert_raises(
+            redis.exceptions.ConnectionError, self.breaker.call, fail,
+            redis.exceptions.TimeoutError('slow'))
+        assert self.breaker.consecutive == 1
+
+    def test_answered(self):
+        self.breaker.failure('down')
+        # errors from Redis itself mean Redis is up
+        tools.assert_raises(
+            redis.exceptions.ResponseError, self.breaker.call, fail,
+            redis.exceptions.ResponseError('wrong type'))
+        assert self.breaker.consecutive == 0
+
+    def test_client(self):
+        # nothing listens on port 1
+        conn = breaker.connect('test', failures=2, port=1)
+        for i in range(2):
+            tools.assert_raises(
+                redis.exceptions.ConnectionError, conn.get, 'foo')
+        tools.assert_raises(breaker.CircuitOpen, conn.get, 'foo')
+        pipe = conn.pipeline()
+        pipe.set('foo', 'bar')
+        tools.assert_raises(breaker.CircuitOpen, pipe.execute)
+        assert breaker.stats()['test']['state'] == 'open'
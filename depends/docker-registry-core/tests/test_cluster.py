@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Docker.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+
+import mock
+from nose import SkipTest  # noqa
+from nose import tools
+import redis
+
+from docker_registry.core import cluster
+
+HOT = re.compile(r'/json$').search
+
+
+class FakeNode(object):
+    """In-memory stand-in of a node, which can be brought down."""
+
+    def __init__(self):
+        self.data = {}
+        self.down = False
+        self.breaker = mock.Mock(state='closed')
+
+    def _check(self):
+        if self.down:
+            raise redis.exceptions.ConnectionError('down')
+
+    def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self._check()
+        self.data[key] = value
+
+    def mget(self, keys):
+        self._check()
+        return [self.data.get(key) for key in keys]
+
+    def delete(self, *keys):
+        self._check()
+        for key in keys:
+            self.data.pop(key, None)
+
+    def flushdb(self):
+        self._check()
+        self.data.clear()
+
+    def pipeline(self, transaction=False):
+        node = self
+
+        class Pipe(object):
+            commands = []
+
+            def delete(self, key):
+                self.commands.append(key)
+
+            def execute(self):
+                node._check()
+                for key in self.commands:
+                    node.delete(key)
+        return Pipe()
+
+
+class TestCluster(object):
+
+    def setUp(self):
+        self.cluster = cluster.Cluster(
+            ['a', 'b:6380', 'c:6381/2'], replicas=2, hot=HOT)
+        self.fakes = {}
+        for name in self.cluster.clients:
+            self.cluster.clients[name] = self.fakes[name] = FakeNode()
+
+    def test_parse_node(self):
+        assert cluster.parse_node('redis1') == {
+            'host': 'redis1', 'port': 6379, 'db': 0}
+        assert cluster.parse_node('redis1:6380/3') == {
+            'host': 'redis1', 'port': 6380, 'db': 3}
+        assert cluster.parse_node({'host': 'redis1', 'password': 'x'}) == {
+            'host': 'redis1', 'port': 6379, 'db': 0, 'password': 'x'}
+
+    def test_parse_nodes(self):
+        assert cluster.parse_nodes('redis1') == ['redis1']
+        assert cluster.parse_nodes('redis1, redis2:6380 redis3') == [
+            'redis1', 'redis2:6380', 'redis3']
+        assert cluster.parse_nodes(('redis1',)) == ['redis1']
+        tools.assert_raises(TypeError, cluster.parse_nodes, 6379)
+        assert len(cluster.Cluster('a,b').nodes) == 2
+
+    def test_spread(self):
+        for i in range(60):
+            self.cluster.set('key{0}'.format(i), i)
+        assert all(len(fake.data) > 5 for fake in self.fakes.values())
+        assert sum(len(fake.data) for fake in self.fakes.values()) == 60
+        assert self.cluster.mget(['key1', 'key2', 'nokey']) == [1, 2, None]
+
+    def test_replicas(self):
+        self.cluster.set('images/foo/json', '{}')
+        holders = [name for (name, fake) in self.fakes.items()
+                   if 'images/foo/json' in fake.data]
+        assert sorted(holders) == sorted(
+            self.cluster.nodes_for('images/foo/json'))
+        assert len(holders) == 2
+        # still served with a replica down
+        self.fakes[holders[0]].down = True
+        for i in range(10):
+            assert self.cluster.get('images/foo/json') == '{}'
+        self.fakes[holders[1]].down = True
+        tools.assert_raises(redis.exceptions.ConnectionError,
+                            self.cluster.get, 'images/foo/json')
+
+    def test_missed_flush(self):
+        self.cluster.set('images/foo/json', '{}')
+        self.cluster.set('images/bar/json', '{}')
+        (owner, replica) = self.cluster.nodes_for('images/foo/json')
+        self.fakes[replica].down = True
+        tools.assert_raises(redis.exceptions.ConnectionError,
+                            self.cluster.delete, 'images/foo/json')
+        assert 'images/foo/json' in self.fakes[replica].data
+        self.fakes[replica].down = False
+        # flushed before the replica serves anything again
+        for i in range(10):
+            assert self.cluster.get('images/foo/json') is None
+        assert not self.fakes[replica].data
+        # then used as usual
+        self.cluster.set('images/foo/json', '{}')
+        assert 'images/foo/json' in self.fakes[replica].data
+
+    def test_reopened_flush(self):
+        self.cluster.set('foo', 'bar')
+        (owner,) = self.cluster.nodes_for('foo')
+        # other workers may have missed writes while the circuit was open
+        self.fakes[owner].breaker.state = 'half-open'
+        assert self.cluster.mget(['foo']) == [None]
+        assert not self.fakes[owner].data
+
+    def test_node_down(self):
+        self.cluster.set('foo', 'bar')
+        (owner,) = self.cluster.nodes_for('foo')
+        self.fakes[owner].down = True
+        # a miss, not moved to another node
+        tools.assert_raises(redis.exceptions.ConnectionError,
+                            self.cluster.get, 'foo')
+        tools.assert_raises(redis.exceptions.ConnectionError,
+                            self.cluster.set, 'foo', 'baz')
+        assert self.cluster.mget(['foo']) == [None]
+        tools.assert_raises(redis.exceptions.ConnectionError,
+                            self.cluster.delete, 'foo')
+        self.fakes[owner].down = False
+        self.cluster.delete('foo')
+        assert self.cluster.get('foo') is None
+
+
+class TestLive(object):
+    """Runs against local redis-server instances, listed as
+
+        REDIS_CLUSTER_NODES=localhost:6379,localhost:6380
+    """
+
+    def setUp(self):
+        nodes = os.environ.get('REDIS_CLUSTER_NODES')
+        if not nodes:
+            raise SkipTest('REDIS_CLUSTER_NODES is not set')
+        self.cluster = cluster.Cluster(nodes.split(','), hot=HOT)
+
+    def test_round_trip(self):
+        keys = ['test_cluster:{0}'.format(i) for i in range(20)]
+        keys.append('test_cluster:images/foo/json')
+        pipe = self.cluster.pipeline()
+        for key in keys:
+            pipe.set(key, key)
+        pipe.execute()
+        assert self.cluster.mget(keys) == keys
+        for key in keys:
+            assert self.cluster.get(key) == key
+            assert self.cluster.getrange(key, 0, 3) == key[:4]
+        self.cluster.delete(*keys)
+        assert self.cluster.mget(keys) == [None] * len(keys)
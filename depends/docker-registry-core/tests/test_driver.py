@@ -39,3 +39,48 @@ class TestDriverFile(testing.Driver):
         self.scheme = 'file'
         self.path = ''
         self.config = testing.Config({})
+
+
+class TestDriverFileSharded(testing.Driver):
+    def __init__(self):
+        self.scheme = 'file'
+        self.path = ''
+        self.config = testing.Config({'storage_shard_depth': 2})
+
+    def test_sharded_paths(self):
+        image_id = 'abcdef' + self.gen_random_string()
+        p = self._storage.image_json_path(image_id)
+        assert p == 'images/ab/cd/{0}/json'.format(image_id)
+        p = self._storage.image_layer_path('a')
+        assert p == 'images/a_/__/a/layer'
+
+    def test_shard_image(self):
+        image_id = self.gen_random_string()
+        json_path = self._storage.image_json_path(image_id)
+        layer_path = self._storage.image_layer_path(image_id)
+        flat_path = 'images/{0}'.format(image_id)
+        # Written before sharding was enabled
+        self._storage.put_content(flat_path + '/json', 'old json')
+        self._storage.put_content(flat_path + '/layer', 'layer')
+        assert flat_path in list(self._storage.list_directory('images'))
+        # Written to the shard since
+        self._storage.put_content(json_path, 'new json')
+        assert self._storage.exists(layer_path)
+        assert self._storage.get_content(layer_path) == 'layer'
+        assert self._storage.get_content(json_path) == 'new json'
+        images = list(self._storage.list_directory('images'))
+        # Listed once, from its shard
+        assert flat_path not in images
+        assert images.count(self._storage.image_path(image_id)) == 1
+        assert image_id in list(self._storage.flat_images())
+
+        assert self._storage.shard_image(image_id) == 1
+        assert not self._storage.exists(flat_path)
+        assert self._storage.get_content(layer_path) == 'layer'
+        assert self._storage.get_content(json_path) == 'new json'
+        images = list(self._storage.list_directory('images'))
+        assert flat_path not in images
+        assert self._storage.image_path(image_id) in images
+        assert image_id not in list(self._storage.flat_images())
+        assert self._storage.shard_image(image_id) == 0
+        self._storage.remove(self._storage.image_path(image_id))
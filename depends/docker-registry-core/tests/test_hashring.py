@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Docker.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from docker_registry.core import hashring
+
+
+class TestHashRing(object):
+
+    keys = ['key-{0}'.format(i) for i in range(2000)]
+
+    def test_empty(self):
+        assert hashring.HashRing().get('foo') is None
+
+    def test_spread(self):
+        ring = hashring.HashRing(['a', 'b', 'c', 'd'])
+        counts = {}
+        for key in self.keys:
+            node = ring.get(key)
+            counts[node] = counts.get(node, 0) + 1
+        assert sorted(counts) == ['a', 'b', 'c', 'd']
+        # every node gets its share, give or take
+        assert min(counts.values()) > len(self.keys) / 4 / 2
+
+    def test_stable(self):
+        ring = hashring.HashRing(['a', 'b', 'c', 'd'])
+        before = dict((key, ring.get(key)) for key in self.keys)
+        ring.add('e')
+        moved = [key for key in self.keys if ring.get(key) != before[key]]
+        # only keys taken by the new node move
+        assert set(ring.get(key) for key in moved) == set(['e'])
+        assert len(moved) < len(self.keys) / 3
+        ring.remove('e')
+        assert dict((key, ring.get(key)) for key in self.keys) == before
+
+    def test_get_nodes(self):
+        ring = hashring.HashRing(['a', 'b', 'c'])
+        for key in self.keys[:100]:
+            nodes = ring.get_nodes(key, 2)
+            assert nodes[0] == ring.get(key)
+            assert len(set(nodes)) == 2
+        assert sorted(ring.get_nodes('foo', 5)) == ['a', 'b', 'c']
+        assert hashring.HashRing().get_nodes('foo', 2) == []
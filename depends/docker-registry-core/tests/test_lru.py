@@ -14,6 +14,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import mock
+
 from docker_registry.core import compat
 from docker_registry.core import lru
 
@@ -44,6 +46,11 @@ class Dumb(object):
     def set(self, key, value):
         self.value[key] = value
 
+    @lru.get_many
+    def get_many(self, keys):
+        return dict((key, self.value[key]) for key in keys
+                    if key in self.value)
+
     @lru.remove
     def remove(self, key):
         if key not in self.value:
@@ -112,3 +119,288 @@ class TestLru(object):
         self._dumb.remove('foo')
         assert not self._dumb.get('foo')
         assert not self._dumb.get('foo')
+
+    def testGetMany(self):
+        self._dumb.set('foo', 'bar')
+        self._dumb.value['baz'] = 'qux'
+        assert self._dumb.get_many(['foo', 'baz', 'nonexistent']) == {
+            'foo': b'bar', 'baz': b'qux'}
+
+
+class TestBypass(object):
+
+    def testBypass(self):
+        conn = mock.Mock()
+        with mock.patch.object(lru, 'redis_conn', conn):
+            get = lru.get(lambda self, key: 'content')
+            remove = lru.remove(lambda self, key: None)
+        dumb = Dumb()
+        dumb.use_lru = False
+        assert get(dumb, 'foo') == 'content'
+        remove(dumb, 'foo')
+        assert not conn.method_calls
+
+
+class TestGetMany(object):
+
+    def testMisses(self):
+        conn = mock.Mock()
+        conn.mget.return_value = [None, None]
+        with mock.patch.object(lru, 'redis_conn', conn):
+            get_many = lru.get_many(
+                lambda self, paths: {'images/foo/json': 'content'})
+            with mock.patch.object(lru, 'missed', {}):
+                assert get_many(Dumb(), [
+                    'images/foo/json', 'images/bar/json']) == {
+                        'images/foo/json': 'content'}
+        # one MGET, then the misses cached in one pipeline
+        assert conn.mget.call_count == 1
+        assert not conn.get.called
+        pipe = conn.pipeline.return_value
+        assert pipe.set.call_args[0][0] == lru.cache_key('images/foo/json')
+        assert pipe.execute.call_count == 1
+
+
+class TestMissed(object):
+
+    def setUp(self):
+        self.conn = mock.Mock()
+        self.conn.getrange.return_value = None
+        self.conn.get.return_value = None
+        with mock.patch.object(lru, 'redis_conn', self.conn):
+            self.set = lru.set(lambda self, key, content: None)
+            self.remove = lru.remove(lambda self, key: None)
+        self.key = lru.cache_key('images/foo/json')
+
+    def testSynced(self):
+        self.conn.setex.side_effect = lru.redis.exceptions.ConnectionError
+        self.conn.set.side_effect = lru.redis.exceptions.ConnectionError
+        with mock.patch.object(lru, 'redis_conn', self.conn):
+            with mock.patch.object(lru, 'missed', {}):
+                self.set(Dumb(), 'images/foo/json', 'content')
+                assert self.key in lru.missed
+                # Not read before the stale content is deleted
+                self.conn.delete.side_effect = (
+                    lru.redis.exceptions.ConnectionError)
+                assert lru.get_by_key(self.key) is None
+                assert not self.conn.get.called
+                self.conn.delete.side_effect = None
+                assert lru.get_by_key(self.key) is None
+                self.conn.delete.assert_called_with(self.key)
+                assert self.conn.get.called
+                assert not lru.missed
+
+    def testRemove(self):
+        self.conn.delete.side_effect = lru.redis.exceptions.ConnectionError
+        with mock.patch.object(lru, 'redis_conn', self.conn):
+            with mock.patch.object(lru, 'missed', {}):
+                self.remove(Dumb(), 'images/foo/json')
+                assert self.key in lru.missed
+
+    def testMaxMissed(self):
+        with mock.patch.object(lru, 'redis_conn', self.conn):
+            with mock.patch.object(lru, 'missed', {}):
+                with mock.patch.object(lru, 'MAX_MISSED', 1):
+                    lru._missed(['a', 'b'])
+                assert lru.missed is None
+                # Redis is no longer read, nor written
+                assert lru.get_by_key(self.key) is None
+                self.set(Dumb(), 'images/foo/json', 'content')
+                assert not self.conn.method_calls
+
+    def testMutable(self):
+        key = lru.cache_key('repositories/library/foo/tag_latest')
+        with mock.patch.dict(lru.options, ttl=None):
+            assert lru._cached(self.key)
+            assert not lru._cached(key)
+            with mock.patch.object(lru, 'redis_conn', self.conn):
+                assert lru.get_by_key(key) is None
+                self.set(Dumb(), 'repositories/library/foo/tag_latest', 'x')
+                assert not self.conn.method_calls
+        with mock.patch.dict(lru.options, ttl=60):
+            assert lru._cached(key)
+
+
+class TestEncoding(object):
+
+    def testRoundTrip(self):
+        for content in (b'', b'bar', b'\xc3\x9f', b'x' * 4096):
+            assert lru.decode(lru.encode(content)) == content
+        assert lru.decode(lru.encode(u'\xdf')) == b'\xc3\x9f'
+
+    def testCompression(self):
+        content = b'x' * 4096
+        value = lru.encode(content)
+        assert len(value) < len(content)
+        assert value[len(lru.HEADER_MAGIC)] in (lru.ENCODING_ZLIB, 122)
+        # small or incompressible contents are stored raw
+        assert lru.encode(b'bar')[len(lru.HEADER_MAGIC)] in (
+            lru.ENCODING_RAW, 114)
+
+    def testHeader(self):
+        # The header identifies the content, whatever its size
+        assert lru.encode(b'x' * 4096)[:lru.HEADER_SIZE] != lru.encode(
+            b'x' * 4097)[:lru.HEADER_SIZE]
+        assert lru.encode(b'bar')[:lru.HEADER_SIZE] == lru.encode(
+            u'bar')[:lru.HEADER_SIZE]
+
+    def testLegacy(self):
+        # Values cached before they had a header
+        assert lru.decode(b'bar') == b'bar'
+        assert lru.decode(None) is None
+
+    def testAdmission(self):
+        assert lru.admits(b'x' * lru.options['max_value_size'])
+        assert not lru.admits(b'x' * (lru.options['max_value_size'] + 1))
+
+
+class TestL1(object):
+
+    def setUp(self):
+        self._dumb = Dumb()
+        lru.l1 = lru.L1Cache(10)
+
+    def tearDown(self):
+        lru.l1 = None
+
+    def testImmutableOnly(self):
+        self._dumb.value['images/foo/json'] = 'bar'
+        self._dumb.value['repositories/foo/bar/_index_images'] = 'baz'
+        for i in range(2):
+            assert self._dumb.get('images/foo/json') == 'bar'
+            assert self._dumb.get('repositories/foo/bar/_index_images')
+        stats = lru.stats()
+        assert stats['entries'] == 1
+        assert stats['hits'] == 1
+        assert stats['hit_ratio'] == 0.5
+
+    def testImmutablePaths(self):
+        assert lru.l1.admits('images/foo/json')
+        assert lru.l1.admits('images/ab/cd/abcdef/ancestry')
+        assert not lru.l1.admits('repositories/images/foo/json')
+        assert not lru.l1.admits('images/foo/layer')
+        with mock.patch.object(lru, 'cache_prefix', 'cache_path:/'):
+            assert lru._immutable('cache_path:/images/foo/json')
+            assert not lru._immutable(
+                'cache_path:/repositories/images/foo/json')
+
+    def testInvalidate(self):
+        self._dumb.value['images/foo/json'] = 'bar'
+        assert self._dumb.get('images/foo/json') == 'bar'
+        self._dumb.set('images/foo/json', 'baz')
+        assert self._dumb.get('images/foo/json') == 'baz'
+        self._dumb.remove('images/foo')
+        assert lru.stats()['entries'] == 0
+
+    def testEviction(self):
+        cache = lru.L1Cache(10)
+        cache.set('a', '1234')
+        cache.set('b', '1234')
+        cache.get('a')
+        cache.set('c', '1234')
+        assert cache.get('b') is None
+        assert cache.get('a') == '1234'
+        assert cache.size == 8
+        assert cache.stats()['evictions'] == 1
+        # too big to be cached at all
+        cache.set('d', '12345678901')
+        assert cache.get('d') is None
+
+    def testMutable(self):
+        cache = lru.L1Cache(10)
+        path = 'repositories/foo/bar/_tags'
+        assert cache.admits('images/foo/json')
+        assert not cache.admits(path)
+        cache.shared = True
+        assert cache.admits(path)
+        assert cache.admits('repositories/foo/bar/tag_latest')
+        assert not cache.admits('repositories/foo/bar/_private')
+
+    def testGeneration(self):
+        cache = lru.L1Cache(10)
+        generation = cache.generation
+        cache.invalidate(['b'])
+        # read before the invalidation, may be stale
+        cache.set('a', '1234', generation)
+        assert cache.get('a') is None
+        cache.set('a', '1234', cache.generation)
+        assert cache.get('a') == '1234'
+
+
+class TestBus(object):
+
+    def setUp(self):
+        self.cache = lru.L1Cache(10)
+        self.bus = lru.Bus(None, 'test', self.cache)
+
+    def testHandle(self):
+        self.cache.set('repositories/foo/bar/_tags', '{}')
+        self.cache.set('images/foo/json', '{}')
+        self.cache.set('images/foo/ancestry', '[]')
+        self.bus.handle('{"keys": ["repositories/foo/bar/_tags"]}')
+        assert self.cache.get('repositories/foo/bar/_tags') is None
+        assert self.cache.get('images/foo/json') == '{}'
+        self.bus.handle('{"keys": ["images/foo"], "prefix": true}')
+        assert self.cache.stats()['entries'] == 0
+
+    def testInvalid(self):
+        self.cache.set('a', '1234')
+        self.bus.handle('garbage')
+        self.bus.handle('{"nokeys": []}')
+        assert self.cache.get('a') == '1234'
+
+
+class Sink(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def incr(self, name, count=1):
+        self.sent.append((name, count))
+
+    def timing(self, name, seconds):
+        raise ValueError('unreachable')
+
+
+class TestMetrics(object):
+
+    def setUp(self):
+        self.metrics = lru.Metrics()
+
+    def testPathClass(self):
+        assert lru.path_class('images/ab/abcd/json') == 'image_json'
+        assert lru.path_class('/srv/images/abcd/ancestry') == 'ancestry'
+        assert lru.path_class('images/abcd/_files') == 'files'
+        assert lru.path_class('images/abcd/_diff') == 'diff'
+        assert lru.path_class('repositories/foo/bar/_tags') == 'tags'
+        assert lru.path_class('repositories/foo/bar/tag_latest') == 'tags'
+        assert lru.path_class('repositories/foo/bar/json') == (
+            'repository_json')
+        assert lru.path_class('images/abcd/layer') == 'other'
+
+    def testSnapshot(self):
+        self.metrics.incr('redis', 'images/abcd/json', 'hits')
+        self.metrics.incr('redis', 'images/abcd/json', 'misses')
+        self.metrics.incr('redis', 'images/abcd/json', 'bytes_read', 10)
+        self.metrics.timing('redis', 'images/abcd/json', 0.5)
+        self.metrics.timing('redis', 'images/abcd/json', 1.5)
+        counters = self.metrics.snapshot()['redis']['image_json']
+        assert counters['hit_ratio'] == 0.5
+        assert counters['bytes_read'] == 10
+        assert counters['latency'] == {'count': 2, 'mean': 1.0, 'max': 1.5}
+
+    def testSink(self):
+        self.metrics.sink = Sink()
+        self.metrics.incr('l1', 'images/abcd/json', 'hits')
+        # errors of the sink are only logged
+        self.metrics.timing('l1', 'images/abcd/json', 0.5)
+        assert self.metrics.sink.sent == [('lru.l1.image_json.hits', 1)]
+        assert self.metrics.snapshot()['l1']['image_json']['latency'][
+            'count'] == 1
+
+    def testEvictions(self):
+        cache = lru.L1Cache(10)
+        cache.on_evict = lambda key: self.metrics.incr('l1', key, 'evictions')
+        cache.set('images/a/json', '12345678')
+        cache.set('images/b/json', '12345678')
+        assert self.metrics.snapshot()['l1']['image_json']['evictions'] == 1